@@ -0,0 +1,72 @@
+import asyncio
+import os
+import sys
+import time
+from dotenv import load_dotenv
+import rate_limiter
+import twitter_client
+from twitter_client import twitter_get, close_session, take_transfer_stats, percentile
+from user_resolver import resolve_user_ids
+
+# Load environment variables
+load_dotenv()
+
+bearer_token = os.getenv('TWITTER_BEARER_TOKEN')
+total_requests = int(os.getenv('BENCHMARK_REQUESTS', 100))
+rounds = int(os.getenv('BENCHMARK_ROUNDS', 2))  # Each round runs both transports, alternating which goes first
+
+timeline_endpoint = '/2/users/:id/tweets'
+
+# Forget what earlier runs learned about the timeline budget, so no run is paced by what another spent
+def reset_budgets():
+    for key in [key for key in rate_limiter.budgets if key.endswith(f" {timeline_endpoint}")]:
+        del rate_limiter.budgets[key]
+
+def print_latencies(latencies):
+    for label, fraction in [("p50", 0.5), ("p95", 0.95), ("p99", 0.99), ("max", 1.0)]:
+        print(f"  {label}: {percentile(latencies, fraction) * 1000:.0f} ms")
+
+# Fire every timeline request at once, the way a monitor cycle fans in on the API host
+async def run_benchmark(user_ids):
+    headers = {
+        "Authorization": f"Bearer {bearer_token}"
+    }
+    urls = [f"https://api.twitter.com/2/users/{user_ids[i % len(user_ids)]}/tweets" for i in range(total_requests)]
+    started = time.perf_counter()
+    responses = await asyncio.gather(*(twitter_get(url, headers=headers, params={"max_results": 5}) for url in urls), return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    await close_session()
+    statuses = {}
+    for response in responses:
+        status = type(response).__name__ if isinstance(response, Exception) else response.status_code
+        statuses[status] = statuses.get(status, 0) + 1
+    latencies = [latency for item in take_transfer_stats().values() for latency in item["latencies"]]
+    return elapsed, latencies, statuses
+
+async def main(usernames):
+    resolved = await resolve_user_ids(usernames)
+    await close_session()
+    user_ids = [user_id for user_id in resolved.values() if user_id]
+    if not user_ids:
+        print("None of the given usernames could be resolved.")
+        return
+    modes = ['http1', 'http2']
+    all_latencies = {mode: [] for mode in modes}
+    for round_number in range(rounds):
+        for mode in (modes if round_number % 2 == 0 else modes[::-1]):
+            twitter_client.transport = mode
+            reset_budgets()
+            elapsed, latencies, statuses = await run_benchmark(user_ids)
+            all_latencies[mode].extend(latencies)
+            print(f"round {round_number + 1} {mode}: {len(latencies)} requests in {elapsed:.2f}s, statuses {statuses}")
+            print_latencies(latencies)
+    if rounds > 1:
+        for mode in modes:
+            print(f"{mode} over {rounds} rounds: {len(all_latencies[mode])} requests")
+            print_latencies(all_latencies[mode])
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python benchmark_transport.py <username> [<username> ...]")
+        sys.exit(1)
+    asyncio.run(main(sys.argv[1:]))
@@ -0,0 +1,59 @@
+import asyncio
+import logging
+import os
+import time
+import weakref
+from telethon.errors import FloodWaitError
+
+broadcast_concurrency = int(os.getenv('BROADCAST_CONCURRENCY', 20))
+max_flood_retries = int(os.getenv('BROADCAST_FLOOD_RETRIES', 3))
+
+# Sends one message to many chats at once, at most `concurrency` sends in flight.
+# Every chat is its own lane: a FloodWaitError pauses that chat for the time Telegram asks
+# and retries, while the other chats carry on. A failing chat never stops the rest.
+class Broadcaster:
+    def __init__(self, telegram_client, concurrency=broadcast_concurrency):
+        self.telegram_client = telegram_client
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.paused_until = {}  # chat ID -> end of its flood wait
+
+    # Send to one chat; returns True once delivered
+    async def send(self, chat_id, message, **kwargs):
+        for attempt in range(max_flood_retries + 1):
+            pause = self.paused_until.get(chat_id, 0) - time.time()
+            if pause > 0:
+                await asyncio.sleep(pause)  # Outside the semaphore, so the slot goes to another chat
+            try:
+                async with self.semaphore:
+                    await self.telegram_client.send_message(chat_id, message, **kwargs)
+                return True
+            except FloodWaitError as e:
+                self.paused_until[chat_id] = time.time() + e.seconds
+                logging.warning(f"Flood wait of {e.seconds} seconds for chat {chat_id} (attempt {attempt + 1})")
+            except Exception as e:
+                logging.error(f"Failed to send to chat {chat_id}: {e}")
+                return False
+        logging.error(f"Giving up on chat {chat_id} after {max_flood_retries + 1} flood waits")  # The first try plus every retry hit one
+        return False
+
+    # Send to every chat concurrently; returns the chats that got the message
+    async def broadcast(self, chat_ids, message, **kwargs):
+        chat_ids = list(chat_ids)
+        started = time.perf_counter()
+        results = await asyncio.gather(*(self.send(chat_id, message, **kwargs) for chat_id in chat_ids))
+        delivered = [chat_id for chat_id, sent in zip(chat_ids, results) if sent]
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        logging.info(f"Broadcast to {len(delivered)} of {len(chat_ids)} chats in {elapsed_ms:.0f} ms")
+        return delivered
+
+# One broadcaster per Telegram client, so every sender on a bot shares its limits
+_broadcasters = weakref.WeakKeyDictionary()
+
+def get_broadcaster(telegram_client):
+    broadcaster = _broadcasters.get(telegram_client)
+    if broadcaster is None:
+        broadcaster = _broadcasters[telegram_client] = Broadcaster(telegram_client)
+    return broadcaster
+
+async def broadcast(telegram_client, chat_ids, message, **kwargs):
+    return await get_broadcaster(telegram_client).broadcast(chat_ids, message, **kwargs)
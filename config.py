@@ -14,3 +14,6 @@ class Config:
     DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
     TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
     CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
+
+    # Accounts master.py forwards from the filtered stream (comma-separated usernames)
+    STREAM_ACCOUNTS = [account.strip().lstrip('@').lower() for account in os.getenv("STREAM_ACCOUNTS", "").split(",") if account.strip()]
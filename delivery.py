@@ -0,0 +1,244 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+import weakref
+from broadcaster import get_broadcaster
+from outbox import Outbox
+
+# Telegram's documented bot limits: about 30 messages per second overall, one per second
+# in a private chat and 20 per minute in a group
+global_rate = float(os.getenv('DELIVERY_GLOBAL_RATE', 30))
+chat_rate = float(os.getenv('DELIVERY_CHAT_RATE', 1))
+group_rate = float(os.getenv('DELIVERY_GROUP_RATE', 20 / 60))
+lane_idle_timeout = float(os.getenv('DELIVERY_LANE_IDLE_TIMEOUT', 60))
+
+# How long a notification may wait for others from the same account and kind to share its
+# message, by default and at most (per-chat windows are clamped to the maximum)
+coalesce_window = float(os.getenv('DELIVERY_COALESCE_WINDOW', 2))
+max_coalesce_window = float(os.getenv('DELIVERY_MAX_COALESCE_WINDOW', 30))
+message_limit = 4096  # Telegram's maximum message length
+coalesce_separator = "\n\n"
+
+# Reservation-based token bucket: each caller takes a token now and sleeps off any debt,
+# so concurrent callers are served in the order they asked
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return max(-self.tokens / self.rate, 0.0)
+
+    async def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+# Outbox key for a message sent without a (kind, item ID): a short hash of its text
+def content_key(message):
+    return "text:" + hashlib.sha1(message.encode()).hexdigest()[:16]
+
+# Group and channel IDs are negative in Telethon's marked form
+def is_group(chat_id):
+    return chat_id < 0
+
+# One queued notification; `group` (account, kind) marks which others it may share a message with
+class Outgoing:
+    def __init__(self, message, kwargs, on_sent, group, entry_id=None):
+        self.queued_at = time.monotonic()
+        self.message = message
+        self.kwargs = kwargs
+        self.on_sent = on_sent
+        self.group = group
+        self.entry_id = entry_id  # Outbox entry, for messages that survive a restart
+
+    @property
+    def mergeable(self):
+        return self.group is not None and not self.kwargs
+
+# Notifications sent as one Telegram message
+class Batch:
+    def __init__(self, item):
+        self.items = [item]
+        self.length = len(item.message)
+
+    def fits(self, item):
+        return self.length + len(coalesce_separator) + len(item.message) <= message_limit
+
+    def add(self, item):
+        self.items.append(item)
+        self.length += len(coalesce_separator) + len(item.message)
+
+    @property
+    def message(self):
+        return coalesce_separator.join(item.message for item in self.items)
+
+    @property
+    def kwargs(self):
+        return self.items[0].kwargs
+
+# Pack notifications into as few messages as fit under Telegram's limit: each mergeable item
+# joins the open batch for its account and kind, and batches go out in order of their first item
+def coalesce(items):
+    batches = []
+    open_batches = {}  # group -> batch still taking items
+    for item in items:
+        batch = open_batches.get(item.group) if item.mergeable else None
+        if batch is not None and batch.fits(item):
+            batch.add(item)
+            continue
+        batch = Batch(item)
+        batches.append(batch)
+        if item.mergeable:
+            open_batches[item.group] = batch
+    return batches
+
+# Outbound messages for one chat, sent in order by a single worker
+class ChatLane:
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        self.queue = asyncio.Queue()
+        self.bucket = TokenBucket(group_rate if is_group(chat_id) else chat_rate, 1)
+        self.task = None
+
+    def drain(self):
+        items = []
+        while not self.queue.empty():
+            items.append(self.queue.get_nowait())
+        return items
+
+# Delivery layer between the fetchers and Telegram. enqueue() returns at once; every chat
+# has its own ordered queue and worker, paced by its per-chat bucket and a bucket shared by
+# the whole bot, so chats are served in parallel without tripping flood limits. Sends go
+# through the client's Broadcaster for its concurrency cap and flood-wait handling.
+# Notifications from the same account and kind that are waiting together (for the chat's
+# coalescing window, or behind its rate limit) go out as one message. Messages are written
+# to the outbox before they are sent and acked after, so a restart resumes what was unsent
+# and skips items a chat already received.
+class Delivery:
+    def __init__(self, telegram_client):
+        self.broadcaster = get_broadcaster(telegram_client)
+        self.outbox = Outbox()
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.lanes = {}  # chat ID -> ChatLane
+        self.coalesce_windows = {}  # chat ID -> seconds, for chats that changed the default
+        self.sent = 0
+        self.coalesced = 0
+        self.failed = 0
+        self.queue_seconds = 0.0
+
+    def coalesce_window(self, chat_id):
+        return self.coalesce_windows.get(chat_id, coalesce_window)
+
+    # Set a chat's coalescing window in seconds (0 sends every notification on its own); returns the value used
+    def set_coalesce_window(self, chat_id, seconds):
+        self.coalesce_windows[chat_id] = min(max(seconds, 0.0), max_coalesce_window)
+        return self.coalesce_windows[chat_id]
+
+    # Queue a message for a chat; `on_sent` is called once Telegram has accepted it.
+    # Messages with the same `group` (account, kind) may be sent together, and a `key`
+    # (such as "Tweet:<id>") is sent to each chat only once; without one, the same text is
+    # not sent twice. Returns False for a repeat.
+    def enqueue(self, chat_id, message, on_sent=None, group=None, key=None, **kwargs):
+        entry_id = None
+        if not kwargs:  # Buttons and files cannot be written to the outbox, so those sends are not durable
+            key = key or content_key(message)
+            if self.outbox.seen(chat_id, key):
+                return False
+            entry_id = self.outbox.add(chat_id, message, key, group)
+        self.lane(chat_id).queue.put_nowait(Outgoing(message, kwargs, on_sent, group, entry_id))
+        return True
+
+    def lane(self, chat_id):
+        lane = self.lanes.get(chat_id)
+        if lane is None:
+            lane = self.lanes[chat_id] = ChatLane(chat_id)
+            lane.task = asyncio.create_task(self.run_lane(lane))
+        return lane
+
+    # Queue the messages a previous run wrote to the outbox but never finished sending
+    async def resume(self):
+        unsent = self.outbox.unsent()
+        for record in unsent:
+            group = tuple(record['group']) if record.get('group') else None
+            self.lane(record['chat']).queue.put_nowait(Outgoing(record['message'], {}, None, group, record['id']))
+        if unsent:
+            logging.info(f"Resuming {len(unsent)} unsent notifications from the outbox")
+
+    # Write out everything the outbox still has buffered
+    def close(self):
+        self.outbox.close()
+
+    async def run_lane(self, lane):
+        while True:
+            try:
+                first = await asyncio.wait_for(lane.queue.get(), lane_idle_timeout)
+            except asyncio.TimeoutError:
+                if lane.queue.empty():
+                    del self.lanes[lane.chat_id]  # Idle chats do not keep a task around
+                    return
+                continue
+            window = self.coalesce_window(lane.chat_id)
+            if window > 0 and first.mergeable:
+                delay = first.queued_at + window - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)  # Let the rest of a burst arrive
+            items = [first] + (lane.drain() if window > 0 else [])
+            batches = coalesce(items)
+            self.coalesced += len(items) - len(batches)
+            for batch in batches:
+                await self.send_batch(lane, batch)
+
+    async def send_batch(self, lane, batch):
+        await lane.bucket.acquire()
+        await self.global_bucket.acquire()
+        await self.outbox.synced()  # Never send a message the outbox could lose
+        now = time.monotonic()
+        self.queue_seconds += sum(now - item.queued_at for item in batch.items)
+        delivered = await self.broadcaster.send(lane.chat_id, batch.message, **batch.kwargs)
+        for item in batch.items:
+            if item.entry_id is not None:
+                self.outbox.ack(item.entry_id, delivered)
+            if delivered and item.on_sent is not None:
+                item.on_sent()
+        if delivered:
+            self.sent += len(batch.items)
+        else:
+            self.failed += len(batch.items)
+
+    def queued(self):
+        return sum(lane.queue.qsize() for lane in self.lanes.values())
+
+    # Counters since the last call
+    def take_stats(self):
+        stats = {"lanes": len(self.lanes), "queued": self.queued(), "sent": self.sent, "failed": self.failed,
+                 "coalesced": self.coalesced, "queue_seconds": self.queue_seconds}
+        self.sent = 0
+        self.failed = 0
+        self.coalesced = 0
+        self.queue_seconds = 0.0
+        return stats
+
+    def log_stats(self):
+        stats = self.take_stats()
+        average_wait = stats["queue_seconds"] / stats["sent"] if stats["sent"] else 0.0
+        logging.info(f"Telegram delivery: {stats['sent']} sent ({stats['coalesced']} merged into other messages), "
+                     f"{stats['failed']} failed, {stats['queued']} queued "
+                     f"across {stats['lanes']} chats, {average_wait:.1f}s average wait")
+
+# One delivery layer per Telegram client, so every sender on a bot shares its buckets
+_deliveries = weakref.WeakKeyDictionary()
+
+def get_delivery(telegram_client):
+    delivery = _deliveries.get(telegram_client)
+    if delivery is None:
+        delivery = _deliveries[telegram_client] = Delivery(telegram_client)
+    return delivery
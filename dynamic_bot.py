@@ -1,9 +1,10 @@
 import logging
 import asyncio
-import requests
 from telethon import TelegramClient, events
 import os
 from dotenv import load_dotenv
+from broadcaster import broadcast
+from twitter_client import twitter_get
 import schedule
 import time
 
@@ -43,8 +44,7 @@ async def handler(event):
 
 # Send messages to all users
 async def send_telegram_message(message):
-    for chat_id in user_chat_ids:
-        await telegram_client.send_message(chat_id, message)
+    await broadcast(telegram_client, user_chat_ids, message)
 
 async def fetch_and_send_tweets():
     logging.debug("Fetching tweets")
@@ -53,9 +53,9 @@ async def fetch_and_send_tweets():
     }
     query = "from:EliudOwalo OR to:EliudOwalo"
     url = f"https://api.twitter.com/2/tweets/search/recent?query={query}&max_results=10"
-    response = requests.get(url, headers=headers)
+    response = await twitter_get(url, headers=headers)
     if response.status_code == 200:
-        logging.debug(f"Response Data: {response.json()}")
+        logging.debug(f"Response: {response.status_code}, {len(response.content)} bytes")
         tweets = response.json().get('data', [])
         if not tweets:
             logging.debug("No tweets found.")
@@ -1,10 +1,11 @@
 import logging
 import asyncio
-import requests
 from telethon import TelegramClient, events
 import os
 from dotenv import load_dotenv
 from user_manager import save_chat_id, get_user_chat_ids
+from broadcaster import broadcast
+from twitter_client import twitter_get
 
 # Setup logging
 logging.basicConfig(level=logging.DEBUG)
@@ -50,8 +51,7 @@ async def username_handler(event):
 async def send_telegram_message(message):
     chat_ids = get_user_chat_ids()
     print(f"Broadcasting to chat IDs: {chat_ids}")
-    for chat_id in list(chat_ids):  # Use a copy of the set
-        await telegram_client.send_message(chat_id, message)
+    await broadcast(telegram_client, chat_ids, message)
 
 # Fetch latest tweets based on username
 async def fetch_latest_tweets(username, since_id):
@@ -59,7 +59,7 @@ async def fetch_latest_tweets(username, since_id):
         "Authorization": f"Bearer {bearer_token}"
     }
     user_url = f"https://api.twitter.com/2/users/by/username/{username}"
-    user_response = requests.get(user_url, headers=headers)
+    user_response = await twitter_get(user_url, headers=headers)
     if user_response.status_code == 200:
         user_id = user_response.json().get('data', {}).get('id', None)
         if user_id:
@@ -68,7 +68,7 @@ async def fetch_latest_tweets(username, since_id):
                 "max_results": 10
             } if since_id else {"max_results": 10}
             tweets_url = f"https://api.twitter.com/2/users/{user_id}/tweets"
-            tweets_response = requests.get(tweets_url, headers=headers, params=params)
+            tweets_response = await twitter_get(tweets_url, headers=headers, params=params)
             if tweets_response.status_code == 200:
                 tweets = tweets_response.json().get('data', [])
                 return tweets
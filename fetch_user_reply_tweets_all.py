@@ -1,10 +1,13 @@
 import logging
-import asyncio
-import requests
 from telethon import TelegramClient, events
 import os
 from dotenv import load_dotenv
 from user_manager import save_chat_id, get_user_chat_ids
+from broadcaster import broadcast
+from twitter_client import twitter_get
+from user_resolver import resolve_username
+from query_packer import SearchPacker
+from field_profiles import profile_params
 
 # Setup logging
 logging.basicConfig(level=logging.DEBUG)
@@ -47,42 +50,29 @@ async def username_handler(event):
 async def send_telegram_message(message):
     chat_ids = get_user_chat_ids()
     print(f"Broadcasting to chat IDs: {chat_ids}")
-    for chat_id in list(chat_ids):  # Use a copy of the set
-        await telegram_client.send_message(chat_id, message)
+    await broadcast(telegram_client, chat_ids, message)
 
 async def fetch_username(user_id):
-    headers = {
-        "Authorization": f"Bearer {bearer_token}"
-    }
-    url = f"https://api.twitter.com/2/users/{user_id}"
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        user_data = response.json().get('data', {})
-        username = user_data.get('username', 'unknown_user')
-        return username
-    else:
-        logging.error(f"Error fetching username: {response.status_code} {response.text}")
-        return 'unknown_user'
+    return await resolve_username(user_id) or 'unknown_user'
 
 async def fetch_tweets(user_id, headers):
     tweets_url = f"https://api.twitter.com/2/users/{user_id}/tweets?max_results=10"
-    tweets_response = requests.get(tweets_url, headers=headers)
+    tweets_response = await twitter_get(tweets_url, headers=headers)
     if tweets_response.status_code == 200:
         tweets = tweets_response.json().get('data', [])
         return tweets
     return []
 
-async def fetch_replies_to_tweet(tweet_id, headers):
-    replies_url = f"https://api.twitter.com/2/tweets/search/recent?query=conversation_id:{tweet_id}&tweet.fields=author_id,conversation_id,in_reply_to_user_id"
-    replies_response = requests.get(replies_url, headers=headers)
-    if replies_response.status_code == 200:
-        replies = replies_response.json().get('data', [])
-        return replies
-    return []
+# Replies to several tweets with packed conversation_id: searches, keyed by tweet ID
+async def fetch_replies_to_tweets(tweet_ids):
+    packer = SearchPacker('conversation_id', 'conversation_id')
+    packer.set_keys(tweet_ids)
+    replies_by_conversation, decoded = await packer.poll(profile_params("conversation"))
+    return replies_by_conversation
 
 async def fetch_user_replies(user_id, headers):
-    user_replies_url = f"https://api.twitter.com/2/tweets/search/recent?query=from:{user_id}&tweet.fields=conversation_id,author_id,in_reply_to_user_id"
-    user_replies_response = requests.get(user_replies_url, headers=headers)
+    user_replies_url = f"https://api.twitter.com/2/tweets/search/recent?query=from:{user_id}"
+    user_replies_response = await twitter_get(user_replies_url, headers=headers)
     if user_replies_response.status_code == 200:
         user_replies = user_replies_response.json().get('data', [])
         return user_replies
@@ -93,7 +83,7 @@ async def fetch_tweets_and_replies(username):
         "Authorization": f"Bearer {bearer_token}"
     }
     user_url = f"https://api.twitter.com/2/users/by/username/{username}"
-    user_response = requests.get(user_url, headers=headers)
+    user_response = await twitter_get(user_url, headers=headers)
     if user_response.status_code == 200:
         user_id = user_response.json().get('data', {}).get('id', None)
         if user_id:
@@ -101,14 +91,12 @@ async def fetch_tweets_and_replies(username):
             user_replies = await fetch_user_replies(user_id, headers)
             messages = []
 
-            tasks = []
             for tweet in tweets:
                 messages.append(f"Tweet: {tweet['text']}")
-                tasks.append(fetch_replies_to_tweet(tweet['id'], headers))
 
-            replies_results = await asyncio.gather(*tasks)
-            for replies in replies_results:
-                for reply in replies:
+            replies_by_tweet = await fetch_replies_to_tweets([tweet['id'] for tweet in tweets])
+            for tweet in tweets:
+                for reply in replies_by_tweet.get(tweet['id'], []):
                     messages.append(f"  Reply: {reply['text']}")
 
             for reply in user_replies:
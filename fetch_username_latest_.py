@@ -1,10 +1,12 @@
 import logging
 import asyncio
-import requests
 from telethon import TelegramClient, events
 import os
 from dotenv import load_dotenv
 from user_manager import save_chat_id, get_user_chat_ids
+from broadcaster import broadcast
+from twitter_client import twitter_get
+from user_resolver import resolve_username
 
 # Setup logging
 logging.basicConfig(level=logging.DEBUG)
@@ -47,34 +49,22 @@ async def username_handler(event):
 async def send_telegram_message(message):
     chat_ids = get_user_chat_ids()
     print(f"Broadcasting to chat IDs: {chat_ids}")
-    for chat_id in list(chat_ids):  # Use a copy of the set
-        await telegram_client.send_message(chat_id, message)
+    await broadcast(telegram_client, chat_ids, message)
 
 async def fetch_username(user_id):
-    headers = {
-        "Authorization": f"Bearer {bearer_token}"
-    }
-    url = f"https://api.twitter.com/2/users/{user_id}"
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        user_data = response.json().get('data', {})
-        username = user_data.get('username', 'unknown_user')
-        return username
-    else:
-        logging.error(f"Error fetching username: {response.status_code} {response.text}")
-        return 'unknown_user'
+    return await resolve_username(user_id) or 'unknown_user'
 
 async def fetch_latest_tweet(username):
     headers = {
         "Authorization": f"Bearer {bearer_token}"
     }
     user_url = f"https://api.twitter.com/2/users/by/username/{username}"
-    user_response = requests.get(user_url, headers=headers)
+    user_response = await twitter_get(user_url, headers=headers)
     if user_response.status_code == 200:
         user_id = user_response.json().get('data', {}).get('id', None)
         if user_id:
             tweets_url = f"https://api.twitter.com/2/users/{user_id}/tweets?max_results=5"
-            tweets_response = requests.get(tweets_url, headers=headers)
+            tweets_response = await twitter_get(tweets_url, headers=headers)
             if tweets_response.status_code == 200:
                 tweets = tweets_response.json().get('data', [])
                 if tweets:
@@ -0,0 +1,31 @@
+# Minimal tweet.fields / user.fields / expansions for each kind of consumer.
+# The API always returns id and text for tweets and id, name and username for users,
+# so profiles only ask for what a renderer or router reads on top of that.
+field_profiles = {
+    # Tweet and like notifications only render the text and link
+    "timeline": {},
+    # Reply notifications render "Reply to @owner" and are routed by author
+    "reply": {
+        "tweet.fields": "author_id,in_reply_to_user_id",
+        "expansions": "in_reply_to_user_id"
+    },
+    # Replies to a monitored account, routed by the replied-to user
+    "reply_to": {
+        "tweet.fields": "in_reply_to_user_id"
+    },
+    # Replies under a monitored tweet, routed by conversation
+    "conversation": {
+        "tweet.fields": "conversation_id"
+    },
+    # Filtered stream matches, routed by author
+    "stream": {
+        "tweet.fields": "author_id",
+        "expansions": "author_id"
+    },
+    # Username <-> ID lookups
+    "user_lookup": {},
+}
+
+# Request parameters for a named profile, merged over any extra parameters
+def profile_params(name, **extra):
+    return {**extra, **field_profiles[name]}
@@ -1,11 +1,19 @@
 import logging
 import asyncio
-import requests
+import time
 from telethon import TelegramClient, events
 import os
 from dotenv import load_dotenv
 from user_manager import save_chat_id, get_user_chat_ids
-import time
+from twitter_client import twitter_get, take_transfer_stats, format_transfer_stats
+from user_resolver import resolve_user_id, resolve_user_ids, resolve_username
+from field_profiles import profile_params
+from poll_interval import PollSchedule
+from subscriptions import SubscriptionRegistry
+from task_commands import register_task_commands
+from delivery import get_delivery
+from query_packer import SearchPacker
+from watermarks import watermark_view, save_watermarks
 
 # Setup logging
 logging.basicConfig(level=logging.DEBUG)
@@ -37,51 +45,65 @@ async def handler(event):
 
 @telegram_client.on(events.NewMessage)
 async def username_handler(event):
+    if event.message.message.startswith('/'):
+        return  # Commands have their own handlers
     usernames = event.message.message.strip().replace('@', '').split(',')
+    for username in usernames:
+        subscriptions.subscribe(event.chat_id, username)
     await event.respond(f"Monitoring accounts: {', '.join(usernames)}...")
-    asyncio.create_task(monitor_accounts(usernames, event))
+    ensure_monitoring()
+
+# Followed accounts and the chats subscribed to each, shared by every chat
+subscriptions = SubscriptionRegistry()
+register_task_commands(telegram_client, subscriptions)  # /tasks, /pause, /resume, /cancel
+monitor_task = None
+
+# One poller for the whole bot, started by the first subscription
+def ensure_monitoring():
+    global monitor_task
+    if monitor_task is None or monitor_task.done():
+        monitor_task = asyncio.create_task(monitor_accounts())
+
+# Send a notification about an account to every chat that follows it
+async def notify_subscribers(username, message, **kwargs):
+    await subscriptions.notify(telegram_client, username, message, **kwargs)
 
 # Monitor multiple accounts for tweets, replies, and likes
-async def monitor_accounts(usernames, event):
-    last_tweet_ids = {username: None for username in usernames}
-    last_reply_ids = {username: None for username in usernames}
-    last_like_ids = {username: None for username in usernames}
+async def monitor_accounts():
+    # since_ids are persisted, so the first poll after a restart only brings back new items
+    last_tweet_ids = watermark_view('tweets')
+    last_like_ids = watermark_view('likes')
+    poll_schedule = PollSchedule(60)  # Per-account intervals, starting from the old fixed one
+    reply_packer = SearchPacker('from', 'author_id', since_ids=watermark_view('replies'))  # Replies for many accounts per search call
+    reply_interval = 60  # One packed search covers every account, so replies keep a fixed cadence
+    replies_due = 0.0
     while True:
-        tasks = [monitor_account(username, last_tweet_ids, last_reply_ids, last_like_ids, event) for username in usernames]
+        usernames = subscriptions.accounts()  # Each followed account once, however many chats follow it
+        for username in usernames:
+            last_tweet_ids.setdefault(username, None)
+            last_like_ids.setdefault(username, None)
+        tasks = [monitor_account(username, last_tweet_ids, last_like_ids, poll_schedule) for username in poll_schedule.due(usernames)]
+        if usernames and time.time() >= replies_due:
+            user_ids = await resolve_user_ids(usernames)
+            tasks.append(fetch_replies(reply_packer, user_ids, poll_schedule))
+            replies_due = time.time() + reply_interval
         await asyncio.gather(*tasks)
-        await asyncio.sleep(60)  # Check for updates every 60 seconds
-
-async def monitor_account(username, last_tweet_ids, last_reply_ids, last_like_ids, event):
+        poll_schedule.log_intervals()
+        logging.info(f"Twitter transfer this cycle: {format_transfer_stats(take_transfer_stats())}")
+        wait = poll_schedule.next_due_in(usernames)
+        if usernames:
+            wait = min(wait, replies_due - time.time())
+        await subscriptions.wait_for_change(max(wait, 1))  # Until the next account or the replies are due, or subscriptions change
+
+async def monitor_account(username, last_tweet_ids, last_like_ids, poll_schedule):
     user_id = await fetch_user_id(username)
     if user_id:
-        await fetch_tweets(user_id, username, last_tweet_ids, event)
-        await fetch_replies(user_id, username, last_reply_ids, event)
-        await fetch_likes(user_id, username, last_like_ids, event)
+        await fetch_tweets(user_id, username, last_tweet_ids, poll_schedule)
+        await fetch_likes(user_id, username, last_like_ids)
 
-import time
 
 async def fetch_user_id(username):
-    headers = {
-        "Authorization": f"Bearer {bearer_token}"
-    }
-    user_url = f"https://api.twitter.com/2/users/by/username/{username}"
-    user_response = requests.get(user_url, headers=headers)
-    
-    logging.debug(f"Twitter API response status code: {user_response.status_code}")
-    logging.debug(f"Twitter API response headers: {user_response.headers}")
-    
-    if user_response.status_code == 429:
-        reset_time = int(user_response.headers["x-rate-limit-reset"])
-        current_time = time.time()
-        sleep_time = reset_time - current_time
-        logging.info(f"Rate limit hit. Sleeping for {sleep_time} seconds.")
-        time.sleep(sleep_time)
-        return await fetch_user_id(username)  # Retry after sleeping
-    
-    if user_response.status_code == 200:
-        user_id = user_response.json().get('data', {}).get('id', None)
-        return user_id
-    return None
+    return await resolve_user_id(username)
 
 # Function to shorten text to 4 lines
 def shorten_text(text, max_lines=4):
@@ -91,7 +113,7 @@ def shorten_text(text, max_lines=4):
     return '\n'.join(lines[:max_lines]) + '…'
 
 # Fetch tweets and send them to Telegram with shortened text
-async def fetch_tweets(user_id, username, last_tweet_ids, event):
+async def fetch_tweets(user_id, username, last_tweet_ids, poll_schedule):
     headers = {
         "Authorization": f"Bearer {bearer_token}"
     }
@@ -100,10 +122,12 @@ async def fetch_tweets(user_id, username, last_tweet_ids, event):
         "max_results": 10
     } if last_tweet_ids[username] else {"max_results": 10}
     tweets_url = f"https://api.twitter.com/2/users/{user_id}/tweets"
-    tweets_response = requests.get(tweets_url, headers=headers, params=params)
+    tweets_response = await twitter_get(tweets_url, headers=headers, params=params)
     
     if tweets_response.status_code == 200:
         tweets = tweets_response.json().get('data', [])
+        if last_tweet_ids[username]:  # The first fetch returns backlog, not new posts
+            poll_schedule.record(username, len(tweets))
         if tweets:
             for tweet in tweets:
                 # Apply shorten_text function to limit tweet content to 4 lines
@@ -111,47 +135,34 @@ async def fetch_tweets(user_id, username, last_tweet_ids, event):
                 tweet_link = f"https://twitter.com/{username}/status/{tweet['id']}"
                 
                 # Send formatted tweet notification to Telegram
-                await event.respond(f"New tweet from @{username}:\n\"{text}\"\nRead more: {tweet_link}")
+                await notify_subscribers(username, f"New tweet from @{username}:\n\"{text}\"\nRead more: {tweet_link}", kind="Tweet", item_id=tweet['id'])
                 
             last_tweet_ids[username] = tweets[0]['id']
 
-async def fetch_replies(user_id, username, last_reply_ids, event):
-    headers = {
-        "Authorization": f"Bearer {bearer_token}"
-    }
-    params = {
-        "since_id": last_reply_ids[username],
-        "max_results": 10
-    } if last_reply_ids[username] else {"max_results": 10}
-    replies_url = f"https://api.twitter.com/2/tweets/search/recent?query=from:{user_id}&tweet.fields=conversation_id,author_id,in_reply_to_user_id"
-    replies_response = requests.get(replies_url, headers=headers, params=params)
-    if replies_response.status_code == 200:
-        replies = replies_response.json().get('data', [])
-        if replies:
-            for reply in replies:
-                in_reply_to_user_id = reply.get('in_reply_to_user_id')
-                if in_reply_to_user_id:
-                    post_owner = await fetch_username(in_reply_to_user_id)
-                    logging.debug(f"Sending reply to Telegram: {reply['text']}")
-                    await event.respond(f"New reply from @{username} on @{post_owner}'s post: {reply['text']}")
-                else:
-                    logging.debug(f"Sending reply to Telegram: {reply['text']}")
-                    await event.respond(f"New reply from @{username}: {reply['text']}")
-            last_reply_ids[username] = replies[0]['id']
+# Fetch replies for all accounts with packed from: searches and route them back by author
+async def fetch_replies(reply_packer, user_ids, poll_schedule):
+    reply_packer.set_keys(user_ids.values())
+    usernames_by_id = {user_id: username for username, user_id in user_ids.items() if user_id}
+    primed = {user_id for user_id, since_id in reply_packer.key_since_ids.items() if since_id}
+    replies_by_author, decoded = await reply_packer.poll(profile_params("reply"))
+    for user_id, replies in replies_by_author.items():
+        username = usernames_by_id[user_id]
+        if user_id in primed:
+            poll_schedule.record(username, len(replies))  # Replies are posts too
+        for reply in replies:
+            in_reply_to_user_id = reply.get('in_reply_to_user_id')
+            if in_reply_to_user_id:
+                post_owner = decoded.post_owner(reply) or await fetch_username(in_reply_to_user_id)
+                logging.debug(f"Sending reply to Telegram: {reply['text']}")
+                await notify_subscribers(username, f"New reply from @{username} on @{post_owner}'s post: {reply['text']}", kind="Reply", item_id=reply['id'])
+            else:
+                logging.debug(f"Sending reply to Telegram: {reply['text']}")
+                await notify_subscribers(username, f"New reply from @{username}: {reply['text']}", kind="Reply", item_id=reply['id'])
 
 async def fetch_username(user_id):
-    headers = {
-        "Authorization": f"Bearer {bearer_token}"
-    }
-    url = f"https://api.twitter.com/2/users/{user_id}"
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        user_data = response.json().get('data', {})
-        username = user_data.get('username', 'unknown_user')
-        return username
-    return 'unknown_user'
-
-async def fetch_likes(user_id, username, last_like_ids, event):
+    return await resolve_username(user_id) or 'unknown_user'
+
+async def fetch_likes(user_id, username, last_like_ids):
     headers = {
         "Authorization": f"Bearer {oauth_token}"
     }
@@ -160,14 +171,17 @@ async def fetch_likes(user_id, username, last_like_ids, event):
         "max_results": 10
     } if last_like_ids[username] else {"max_results": 10}
     likes_url = f"https://api.twitter.com/2/users/{user_id}/liked_tweets"
-    likes_response = requests.get(likes_url, headers=headers, params=params)
+    likes_response = await twitter_get(likes_url, headers=headers, params=params)
     if likes_response.status_code == 200:
         likes = likes_response.json().get('data', [])
         if likes:
             for like in likes:
                 logging.debug(f"Sending like to Telegram: {like['text']}")
-                await event.respond(f"New like from @{username}: {like['text']}")
+                await notify_subscribers(username, f"New like from @{username}: {like['text']}", kind="Like", item_id=like['id'])
             last_like_ids[username] = likes[0]['id']
 
 if __name__ == "__main__":
+    telegram_client.loop.create_task(get_delivery(telegram_client).resume())  # Notifications a previous run left unsent
     telegram_client.run_until_disconnected()
+    get_delivery(telegram_client).close()
+    save_watermarks()
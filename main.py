@@ -1,15 +1,24 @@
 import logging
 import asyncio
-import requests
 from telethon import TelegramClient, events, Button
 import os
 from dotenv import load_dotenv
 from user_manager import save_chat_id, get_user_chat_ids
+from twitter_client import twitter_get, close_session, take_transfer_stats, format_transfer_stats
+from user_resolver import resolve_user_id, resolve_user_ids
+from query_packer import SearchPacker
+from poll_interval import PollSchedule
+from poll_scheduler import PollScheduler
+from token_pool import pool_limit
+from subscriptions import SubscriptionRegistry
+from task_commands import register_task_commands
+from worker_pool import WorkerPool
+from delivery import get_delivery
+from watermarks import watermark_view, save_watermarks
+from field_profiles import profile_params
 import time
-from datetime import datetime, timedelta
+from datetime import datetime
 import pytz  # Import s for timezone handling
-import threading  # Import threading for multithreading
-import queue  # Import queue for task queuing
 
 # Setup logging
 logging.basicConfig(level=logging.DEBUG)
@@ -33,6 +42,8 @@ admin_user_ids = [7443937029, 7104246753, 5810699032, 1254056054]  # Replace wit
 # Dictionary to keep track of each user's monitoring state
 user_monitoring_states = {}
 user_permissions = {}
+# Action each chat was last asked to confirm ('start' or 'stop'); both prompts share the Yes/No buttons
+pending_confirmations = {}
 
 # Function to convert timestamp to New York time
 def convert_to_new_york_time(timestamp):
@@ -60,6 +71,7 @@ async def start_handler(event):
 @telegram_client.on(events.NewMessage(pattern='🌟 Start Monitoring Twitter Accounts'))
 async def start_monitoring(event):
     if event.chat_id in admin_user_ids:
+        pending_confirmations[event.chat_id] = 'start'
         await event.respond(
             "Are you sure you want to start monitoring Twitter accounts? Please confirm by clicking 'Yes' or 'No'.",
             buttons=[ [Button.text('✅ Yes'), Button.text('❌ No')] ]
@@ -70,18 +82,25 @@ async def start_monitoring(event):
 # Handler for confirming "Start Monitoring"
 @telegram_client.on(events.NewMessage(pattern='✅ Yes'))
 async def confirm_start_monitoring(event):
+    if pending_confirmations.get(event.chat_id) != 'start':
+        return
+    del pending_confirmations[event.chat_id]
     user_monitoring_states[event.chat_id] = True  # Set monitoring state to True
     await event.respond("Monitoring has been started! Please enter Twitter usernames to monitor, separated by commas.")
 
 # Handler for canceling "Start Monitoring"
 @telegram_client.on(events.NewMessage(pattern='❌ No'))
 async def cancel_start_monitoring(event):
+    if pending_confirmations.get(event.chat_id) != 'start':
+        return
+    del pending_confirmations[event.chat_id]
     await event.respond("Monitoring was not started. If you change your mind, click 'Start Monitoring'.")
 
 # Handler for "Stop Monitoring" button
 @telegram_client.on(events.NewMessage(pattern='🚫 Stop Monitoring'))
 async def stop_monitoring(event):
     if event.chat_id in admin_user_ids:
+        pending_confirmations[event.chat_id] = 'stop'
         await event.respond(
             "Are you sure you want to stop monitoring? Please confirm by clicking 'Yes' or 'No'.",
             buttons=[ [Button.text('✅ Yes'), Button.text('❌ No')] ]
@@ -92,12 +111,19 @@ async def stop_monitoring(event):
 # Handler for confirming "Stop Monitoring"
 @telegram_client.on(events.NewMessage(pattern='✅ Yes'))
 async def confirm_stop_monitoring(event):
+    if pending_confirmations.get(event.chat_id) != 'stop':
+        return
+    del pending_confirmations[event.chat_id]
     user_monitoring_states[event.chat_id] = False  # Set monitoring state to False
+    subscriptions.unsubscribe_chat(event.chat_id)  # Accounts nobody else follows stop being polled
     await event.respond("Monitoring has been stopped.")
 
 # Handler for canceling "Stop Monitoring"
 @telegram_client.on(events.NewMessage(pattern='❌ No'))
 async def cancel_stop_monitoring(event):
+    if pending_confirmations.get(event.chat_id) != 'stop':
+        return
+    del pending_confirmations[event.chat_id]
     await event.respond("Monitoring was not stopped. If you change your mind, click 'Stop Monitoring'.")
 
 # Function to get user IDs (temporary function)
@@ -123,6 +149,8 @@ async def settings_handler(event):
 # Handler for user input of Twitter usernames to monitor
 @telegram_client.on(events.NewMessage)
 async def username_handler(event):
+    if event.message.message.startswith('/'):
+        return  # Commands have their own handlers
     if user_monitoring_states.get(event.chat_id, False):
         usernames = event.message.message.strip().replace('@', '').split(',')
         invalid_usernames = []
@@ -136,8 +164,10 @@ async def username_handler(event):
                 invalid_usernames.append(username)
         
         if valid_usernames:
+            for username in valid_usernames:
+                subscriptions.subscribe(event.chat_id, username)
             await event.respond(f"Monitoring the following accounts: {', '.join(valid_usernames)}")
-            asyncio.create_task(monitor_accounts(valid_usernames, event))
+            ensure_monitoring()
         
         if invalid_usernames:
             await event.respond(f"The following usernames were invalid or already added: {', '.join(invalid_usernames)}")
@@ -172,85 +202,80 @@ async def grant_permission_handler(event):
     else:
         await event.respond("You don't have permission to grant access.")
 
-# Initialize cache and message queue
-tweet_cache = {}
-cache_duration = timedelta(minutes=15)  # Cache duration
-tweet_queue = queue.Queue()
-
-# Worker function to process queue
-def tweet_worker():
-    while True:
-        item = tweet_queue.get()
-        if item is None:
-            break
-        asyncio.run(process_queue_item(item))
-        tweet_queue.task_done()
-
-async def process_queue_item(item):
-    await item[0](*item[1:])
-
-# Start worker thread
-worker_thread = threading.Thread(target=tweet_worker)
-worker_thread.start()
-
-# Add tasks to queue
-def add_task_to_queue(task, *args):
-    tweet_queue.put((task, *args))
-
-# Stop the worker thread gracefully
-def stop_worker_thread():
-    tweet_queue.put(None)
-    worker_thread.join()
+# Twitter fetch jobs run on the main loop, several at a time, through a bounded queue
+worker_pool = WorkerPool()
+
+# Add tasks to queue; waits while the queue is full
+async def add_task_to_queue(task, *args, key=None):
+    await worker_pool.submit(task, *args, key=key)
+
+# Stop the poller, let queued jobs finish, then close the pooled Twitter session
+async def shutdown():
+    if monitor_task is not None:
+        monitor_task.cancel()
+        await asyncio.gather(monitor_task, return_exceptions=True)
+    await worker_pool.stop()
+    await close_session()
+    get_delivery(telegram_client).close()
+    save_watermarks()
+
+# Followed accounts and the chats subscribed to each, shared by every chat
+subscriptions = SubscriptionRegistry()
+register_task_commands(telegram_client, subscriptions)  # /tasks, /pause, /resume, /cancel
+monitor_task = None
+
+# One poller for the whole bot, started by the first subscription
+def ensure_monitoring():
+    global monitor_task
+    if monitor_task is None or monitor_task.done():
+        monitor_task = asyncio.create_task(monitor_accounts())
+
+# Send a notification about an account to every chat that follows it
+async def notify_subscribers(username, message, **kwargs):
+    await subscriptions.notify(telegram_client, username, message, **kwargs)
 
 # Monitor multiple accounts for tweets and replies
-async def monitor_accounts(usernames, event):
-    last_tweet_ids = {username: None for username in usernames}
-    last_reply_ids = {username: None for username in usernames}
+async def monitor_accounts():
+    reply_packer = SearchPacker('to', 'in_reply_to_user_id', since_ids=watermark_view('replies_to'))  # Replies to many accounts per search call
+    poll_schedule = PollSchedule(90)  # Per-account intervals, starting from the old fixed one
+    reply_interval = 90  # One packed search covers every account, so replies keep a fixed cadence
+    # Each job class is held to its endpoint's budget summed over the token pool: learned from the API, defaults until the first response
+    scheduler = PollScheduler()
+    scheduler.add_class('tweets', 0, lambda: pool_limit(bearer_token, '/2/users/:id/tweets', 1500))
+    scheduler.add_class('replies', 1, lambda: pool_limit(bearer_token, '/2/tweets/search/recent', 450))
+
+    def interval(username, job_class):
+        return reply_interval if job_class == 'replies' else poll_schedule.interval(username)
+
+    # since_ids are persisted, so the first poll after a restart only brings back new items
+    last_tweet_ids = watermark_view('tweets')
     while True:
+        usernames = subscriptions.accounts()  # Each followed account once, however many chats follow it
         for username in usernames:
-            add_task_to_queue(monitor_account, username, last_tweet_ids, last_reply_ids, event)
-        await asyncio.sleep(90)  # Check for updates every 90 seconds
-
-async def monitor_account(username, last_tweet_ids, last_reply_ids, event):
-    user_id = await fetch_user_id(username)
-    if user_id:
-        add_task_to_queue(fetch_tweets, user_id, username, last_tweet_ids, event)
-        add_task_to_queue(fetch_replies, user_id, username, last_reply_ids, event)
+            last_tweet_ids.setdefault(username, None)
+        jobs = [(username, 'tweets') for username in usernames]
+        if usernames:
+            jobs.append((None, 'replies'))
+        scheduler.sync(jobs, interval)
+        user_ids = await resolve_user_ids(usernames)  # One batched lookup per 100 accounts
+        now = time.time()
+        for username, job_class in scheduler.pop_ready(now):
+            if job_class == 'tweets' and user_ids[username]:
+                await add_task_to_queue(fetch_tweets, user_ids[username], username, last_tweet_ids, poll_schedule, key=(username, job_class))
+            elif job_class == 'replies':
+                await add_task_to_queue(fetch_replies, reply_packer, user_ids, key=(username, job_class))
+                poll_schedule.log_intervals()
+                scheduler.log_lag(now)
+                worker_pool.log_stats()
+                get_delivery(telegram_client).log_stats()
+                logging.info(f"Twitter transfer this cycle: {format_transfer_stats(take_transfer_stats())}")
+            scheduler.schedule(username, job_class, now + interval(username, job_class))
+        # Sleep until the next job is due, waking early when a chat subscribes, pauses or cancels
+        wakeup = scheduler.next_wakeup()
+        await subscriptions.wait_for_change(min(max(wakeup, 0.1), 60) if wakeup is not None else 60)
 
 async def fetch_user_id(username):
-    headers = {
-        "Authorization": f"Bearer {bearer_token}"
-    }
-    user_url = f"https://api.twitter.com/2/users/by/username/{username}"
-    backoff_time = 10
-    while True:
-        user_response = requests.get(user_url, headers=headers)
-
-        logging.debug(f"Twitter API response status code: {user_response.status_code}")
-        logging.debug(f"Twitter API response headers: {user_response.headers}")
-
-        if user_response.status_code == 429:
-            reset_time = int(user_response.headers["x-rate-limit-reset"])
-            current_time = time.time()
-            sleep_time = reset_time - current_time
-            logging.info(f"Rate limit hit. Sleeping for {sleep_time} seconds.")
-            await asyncio.sleep(sleep_time)
-        elif user_response.status_code == 404:
-            logging.error(f"Username '{username}' not found.")
-            return None
-        elif user_response.status_code == 200:
-            try:
-                user_id = user_response.json().get('data', {}).get('id', None)
-                return user_id
-            except ValueError:
-                logging.error("Failed to decode JSON response.")
-                return None
-        else:
-            logging.error(f"Failed to fetch user ID: {user_response.text}")
-            await asyncio.sleep(backoff_time)
-            backoff_time = min(backoff_time * 2, 320)  # Exponential backoff
-
-    return None
+    return await resolve_user_id(username)
 
 # Function to shorten text to 4 lines
 def shorten_text(text, max_lines=4):
@@ -260,72 +285,57 @@ def shorten_text(text, max_lines=4):
     return '\n'.join(lines[:max_lines]) + '…'
 
 # Fetch tweets and send them to Telegram with shortened text
-async def fetch_tweets(user_id, username, last_tweet_ids, event):
-    now = datetime.now()
-    if username in tweet_cache and now - tweet_cache[username]['timestamp'] < cache_duration:
-        tweets = tweet_cache[username]['data']
-    else:
-        headers = {
-            "Authorization": f"Bearer {bearer_token}"
-        }
-        params = {
-            "since_id": last_tweet_ids[username],
-            "max_results": 10
-        } if last_tweet_ids[username] else {"max_results": 10}
-        tweets_url = f"https://api.twitter.com/2/users/{user_id}/tweets"
-        
-        while True:  # Keep retrying on failure
-            tweet_response = requests.get(tweets_url, headers=headers, params=params)
-            if tweet_response.status_code == 200:
-                tweets = tweet_response.json()['data']
-                tweet_cache[username] = {'data': tweets, 'timestamp': now}
-                break
-            elif tweet_response.status_code == 429:  # Rate limit reached
-                reset_time = int(tweet_response.headers.get("x-rate-limit-reset", time.time()))
-                sleep_time = reset_time - time.time()
-                logging.info(f"Rate limit hit while fetching tweets for {username}. Sleeping for {sleep_time} seconds.")
-                await asyncio.sleep(sleep_time)
-            else:
-                logging.error(f"Failed to fetch tweets for {username}: {tweet_response.text}")
-                await asyncio.sleep(10)  # Exponential backoff can be implemented if needed
-                break
-
-    for tweet in tweets:
-        last_tweet_ids[username] = tweet['id']
-        await event.respond(f"New tweet from {username}: \n{shorten_text(tweet['text'])}")
-        logging.info(f"Tweet from {username}: {tweet['text']}")
-
-# Fetch replies for tweets and send them to Telegram
-async def fetch_replies(user_id, username, last_reply_ids, event):
+async def fetch_tweets(user_id, username, last_tweet_ids, poll_schedule):
+    if not subscriptions.is_followed(username):
+        return  # Cancelled or paused while the job was queued
     headers = {
         "Authorization": f"Bearer {bearer_token}"
     }
-    replies_url = f"https://api.twitter.com/2/tweets/search/recent?query=to:{username}"
+    params = {
+        "since_id": last_tweet_ids[username],
+        "max_results": 10
+    } if last_tweet_ids[username] else {"max_results": 10}
+    tweets_url = f"https://api.twitter.com/2/users/{user_id}/tweets"
     
     while True:  # Keep retrying on failure
-        reply_response = requests.get(replies_url, headers=headers)
-        if reply_response.status_code == 200:
-            replies = reply_response.json()['data']
+        tweet_response = await twitter_get(tweets_url, headers=headers, params=params)
+        if tweet_response.status_code == 200:
+            tweets = tweet_response.json().get('data', [])  # No `data` when nothing is new
+            if last_tweet_ids[username]:  # The first fetch returns backlog, not new posts
+                poll_schedule.record(username, len(tweets))
             break
-        elif reply_response.status_code == 429:  # Rate limit reached
-            reset_time = int(reply_response.headers.get("x-rate-limit-reset", time.time()))
+        elif tweet_response.status_code == 429:  # Rate limit reached
+            reset_time = int(tweet_response.headers.get("x-rate-limit-reset", time.time()))
             sleep_time = reset_time - time.time()
-            logging.info(f"Rate limit hit while fetching replies for {username}. Sleeping for {sleep_time} seconds.")
+            logging.info(f"Rate limit hit while fetching tweets for {username}. Sleeping for {sleep_time} seconds.")
             await asyncio.sleep(sleep_time)
         else:
-            logging.error(f"Failed to fetch replies for {username}: {reply_response.text}")
+            logging.error(f"Failed to fetch tweets for {username}: {tweet_response.text}")
             await asyncio.sleep(10)  # Exponential backoff can be implemented if needed
-            break
+            return
 
-    for reply in replies:
-        if reply['id'] != last_reply_ids[username]:
-            last_reply_ids[username] = reply['id']
-            await event.respond(f"New reply to {username}: \n{shorten_text(reply['text'])}")
+    for tweet in tweets:
+        await notify_subscribers(username, f"New tweet from {username}: \n{shorten_text(tweet['text'])}", kind="Tweet", item_id=tweet['id'])
+        logging.info(f"Tweet from {username}: {tweet['text']}")
+    if tweets:
+        last_tweet_ids[username] = tweets[0]['id']  # Newest first, so the next poll only brings back new tweets
+
+# Fetch replies to all accounts with packed to: searches and route them back by replied-to user
+async def fetch_replies(reply_packer, user_ids):
+    reply_packer.set_keys(user_ids.values())
+    usernames_by_id = {user_id: username for username, user_id in user_ids.items() if user_id}
+    replies_by_user, decoded = await reply_packer.poll(profile_params("reply_to"))
+    for user_id, replies in replies_by_user.items():
+        username = usernames_by_id[user_id]
+        for reply in replies:
+            await notify_subscribers(username, f"New reply to {username}: \n{shorten_text(reply['text'])}", kind="Reply", item_id=reply['id'])
             logging.info(f"Reply to {username}: {reply['text']}")
 
 # Run the bot
 async def main():
+    await get_delivery(telegram_client).resume()  # Notifications a previous run left unsent
     await telegram_client.run_until_disconnected()
+    await shutdown()
 
 if __name__ == '__main__':
     asyncio.run(main())
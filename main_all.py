@@ -1,10 +1,12 @@
 import logging
 import asyncio
-import requests
 from telethon import TelegramClient, events
 import os
 from dotenv import load_dotenv
 from user_manager import save_chat_id, get_user_chat_ids
+from broadcaster import broadcast
+from twitter_client import twitter_get
+from user_resolver import resolve_username
 
 # Setup logging
 logging.basicConfig(level=logging.DEBUG)
@@ -38,22 +40,10 @@ async def handler(event):
 async def send_telegram_message(message):
     chat_ids = get_user_chat_ids()
     print(f"Broadcasting to chat IDs: {chat_ids}")
-    for chat_id in list(chat_ids):  # Use a copy of the set
-        await telegram_client.send_message(chat_id, message)
+    await broadcast(telegram_client, chat_ids, message)
 
 async def fetch_username(user_id):
-    headers = {
-        "Authorization": f"Bearer {bearer_token}"
-    }
-    url = f"https://api.twitter.com/2/users/{user_id}"
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        user_data = response.json().get('data', {})
-        username = user_data.get('username', 'unknown_user')
-        return username
-    else:
-        logging.error(f"Error fetching username: {response.status_code} {response.text}")
-        return 'unknown_user'
+    return await resolve_username(user_id) or 'unknown_user'
 
 async def fetch_and_send_user_tweets(user_id):
     username = await fetch_username(user_id)
@@ -62,9 +52,9 @@ async def fetch_and_send_user_tweets(user_id):
         "Authorization": f"Bearer {bearer_token}"
     }
     url = f"https://api.twitter.com/2/users/{user_id}/tweets?max_results=10"
-    response = requests.get(url, headers=headers)
+    response = await twitter_get(url, headers=headers)
     if response.status_code == 200:
-        logging.debug(f"Response Data: {response.json()}")
+        logging.debug(f"Response: {response.status_code}, {len(response.content)} bytes")
         tweets = response.json().get('data', [])
         if not tweets:
             logging.debug("No tweets found.")
@@ -1,10 +1,13 @@
 import logging
 import asyncio
-import requests
 from telethon import TelegramClient, events
 import os
 from dotenv import load_dotenv
 from user_manager import save_chat_id, get_user_chat_ids
+from broadcaster import broadcast
+from twitter_client import twitter_get
+from query_packer import SearchPacker
+from field_profiles import profile_params
 
 # Setup logging
 logging.basicConfig(level=logging.DEBUG)
@@ -37,27 +40,23 @@ async def handler(event):
 async def send_telegram_message(message):
     chat_ids = get_user_chat_ids()
     print(f"Broadcasting to chat IDs: {chat_ids}")
-    for chat_id in list(chat_ids):  # Use a copy of the set
-        await telegram_client.send_message(chat_id, message)
+    await broadcast(telegram_client, chat_ids, message)
 
-async def fetch_and_send_replies(tweet_id):
-    logging.debug(f"Fetching replies for tweet ID: {tweet_id}")
-    headers = {
-        "Authorization": f"Bearer {bearer_token}"
-    }
-    url = f"https://api.twitter.com/2/tweets/search/recent?query=conversation_id:{tweet_id}&tweet.fields=author_id,conversation_id,in_reply_to_user_id"
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        logging.debug(f"Response Data: {response.json()}")
-        tweets = response.json().get('data', [])
-        if not tweets:
-            logging.debug("No replies found.")
-        for tweet in tweets:
+# Packed conversation_id: searches per monitored account, kept across passes for their since_ids
+conversation_packers = {}
+
+async def fetch_and_send_replies(user_id, tweet_ids):
+    logging.debug(f"Fetching replies for {len(tweet_ids)} tweets of user ID: {user_id}")
+    packer = conversation_packers.setdefault(user_id, SearchPacker('conversation_id', 'conversation_id'))
+    packer.set_keys(tweet_ids)
+    replies_by_conversation, decoded = await packer.poll(profile_params("conversation"))
+    if not replies_by_conversation:
+        logging.debug("No replies found.")
+    for tweet_id in tweet_ids:
+        for tweet in replies_by_conversation.get(tweet_id, []):
             message = f'Reply ID: {tweet["id"]}: {tweet["text"]}'
             logging.debug(f"Sending message: {message}")
             await send_telegram_message(message)
-    else:
-        logging.error(f"Error fetching replies: {response.status_code} {response.text}")
 
 async def fetch_tweets_and_check_replies(user_id):
     logging.debug(f"Fetching tweets for user ID: {user_id}")
@@ -65,14 +64,13 @@ async def fetch_tweets_and_check_replies(user_id):
         "Authorization": f"Bearer {bearer_token}"
     }
     url = f"https://api.twitter.com/2/users/{user_id}/tweets?max_results=10"
-    response = requests.get(url, headers=headers)
+    response = await twitter_get(url, headers=headers)
     if response.status_code == 200:
-        logging.debug(f"Response Data: {response.json()}")
+        logging.debug(f"Response: {response.status_code}, {len(response.content)} bytes")
         tweets = response.json().get('data', [])
         if not tweets:
             logging.debug("No tweets found.")
-        for tweet in tweets:
-            await fetch_and_send_replies(tweet["id"])
+        await fetch_and_send_replies(user_id, [tweet["id"] for tweet in tweets])
     else:
         logging.error(f"Error fetching tweets: {response.status_code} {response.text}")
 
@@ -81,10 +79,10 @@ async def fetch_user_replies(user_id):
     headers = {
         "Authorization": f"Bearer {bearer_token}"
     }
-    url = f"https://api.twitter.com/2/tweets/search/recent?query=from:{user_id}&tweet.fields=conversation_id,author_id,in_reply_to_user_id"
-    response = requests.get(url, headers=headers)
+    url = f"https://api.twitter.com/2/tweets/search/recent?query=from:{user_id}"
+    response = await twitter_get(url, headers=headers)
     if response.status_code == 200:
-        logging.debug(f"Response Data: {response.json()}")
+        logging.debug(f"Response: {response.status_code}, {len(response.content)} bytes")
         tweets = response.json().get('data', [])
         if not tweets:
             logging.debug("No tweets found.")
@@ -1,10 +1,11 @@
 import logging
 import asyncio
-import requests
 from telethon import TelegramClient, events
 import os
 from dotenv import load_dotenv
 from user_manager import save_chat_id, get_user_chat_ids
+from delivery import get_delivery
+from twitter_client import twitter_get
 
 # Setup logging
 logging.basicConfig(level=logging.DEBUG)
@@ -53,7 +54,7 @@ async def fetch_user_id(username):
         "Authorization": f"Bearer {bearer_token}"
     }
     user_url = f"https://api.twitter.com/2/users/by/username/{username}"
-    user_response = requests.get(user_url, headers=headers)
+    user_response = await twitter_get(user_url, headers=headers)
     if user_response.status_code == 200:
         user_id = user_response.json().get('data', {}).get('id', None)
         return user_id
@@ -68,13 +69,14 @@ async def fetch_and_relay_likes(user_id, username, last_like_id, event):
         "max_results": 10
     } if last_like_id else {"max_results": 10}
     likes_url = f"https://api.twitter.com/2/users/{user_id}/liked_tweets"
-    likes_response = requests.get(likes_url, headers=headers, params=params)
+    likes_response = await twitter_get(likes_url, headers=headers, params=params)
     if likes_response.status_code == 200:
         likes = likes_response.json().get('data', [])
         if likes:
             for like in likes:
                 logging.debug(f"Sending like to Telegram: {like['text']}")
-                await event.respond(f"New like from @{username}: {like['text']}")
+                get_delivery(telegram_client).enqueue(event.chat_id, f"New like from @{username}: {like['text']}",
+                                                      group=(username.lower(), "Like"), key=f"Like:{like['id']}")
             last_like_id = likes[0]['id']
 
 if __name__ == "__main__":
@@ -0,0 +1,145 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+# Durable outbox for Telegram notifications, stored as an append-only JSON lines log:
+# an "add" record is written before a message is sent and an "ack" record once it is done.
+# Delivered item keys are remembered per chat so a refetched item is never sent twice.
+outbox_file = os.getenv('OUTBOX_FILE', 'outbox.jsonl')
+fsync_interval = float(os.getenv('OUTBOX_FSYNC_INTERVAL', 0.2))  # Writes are fsynced together, at most this often
+ledger_size = int(os.getenv('OUTBOX_LEDGER_SIZE', 1000))  # Delivered keys remembered per chat
+
+class Outbox:
+    def __init__(self, path=outbox_file):
+        self.path = path
+        self.pending = {}  # entry ID -> add record
+        self.pending_keys = {}  # chat ID -> {key: entry ID}
+        self.ledger = {}  # chat ID -> delivered keys, oldest first (dict as an ordered set)
+        self.next_id = 1
+        self.log_lines = 0
+        self.file = None
+        self.flush_handle = None
+        self.flush_waiter = None
+        self.load()
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as file:
+                for line in file:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        self.apply(json.loads(line))
+                    except ValueError:
+                        logging.error(f"Skipping corrupt line in {self.path}")
+                    self.log_lines += 1
+            logging.info(f"Loaded {len(self.pending)} unsent notifications and {sum(map(len, self.ledger.values()))} "
+                         f"delivered keys from {self.path}")
+        if self.log_lines > 2 * max(self.live_records(), 500):
+            self.compact()
+        self.file = open(self.path, 'a')
+
+    def apply(self, record):
+        op = record['op']
+        if op == 'add':
+            self.pending[record['id']] = record
+            if record.get('key'):
+                self.pending_keys.setdefault(record['chat'], {})[record['key']] = record['id']
+            self.next_id = max(self.next_id, record['id'] + 1)
+        elif op == 'ack':
+            entry = self.pending.pop(record['id'], None)
+            if entry is None or not entry.get('key'):
+                return
+            self.pending_keys.get(entry['chat'], {}).pop(entry['key'], None)
+            if record.get('delivered', True):
+                self.remember(entry['chat'], entry['key'])
+        elif op == 'ledger':
+            for key in record['keys']:
+                self.remember(record['chat'], key)
+
+    def remember(self, chat_id, key):
+        keys = self.ledger.setdefault(chat_id, {})
+        keys[key] = None
+        if len(keys) > ledger_size:
+            del keys[next(iter(keys))]
+
+    def live_records(self):
+        return len(self.pending) + len(self.ledger)
+
+    # Whether the item was already sent to the chat, or is waiting to be
+    def seen(self, chat_id, key):
+        return key in self.ledger.get(chat_id, {}) or key in self.pending_keys.get(chat_id, {})
+
+    # Record a message before it is sent; returns its entry ID
+    def add(self, chat_id, message, key=None, group=None):
+        record = {'op': 'add', 'id': self.next_id, 'chat': chat_id, 'key': key, 'group': group, 'message': message, 'ts': time.time()}
+        self.apply(record)
+        self.write(record)
+        return record['id']
+
+    # Close out an entry once Telegram accepted it, or once sending gave up
+    def ack(self, entry_id, delivered=True):
+        record = {'op': 'ack', 'id': entry_id} if delivered else {'op': 'ack', 'id': entry_id, 'delivered': False}
+        self.apply(record)
+        self.write(record)
+        if self.log_lines > 2 * max(self.live_records(), 500):
+            self.flush()
+            self.compact()
+            self.file = open(self.path, 'a')
+
+    # Messages added but never acked, oldest first
+    def unsent(self):
+        return [self.pending[entry_id] for entry_id in sorted(self.pending)]
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + '\n')
+        self.log_lines += 1
+        if self.flush_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        self.flush_waiter = loop.create_future()
+        self.flush_handle = loop.call_later(fsync_interval, self.flush)
+
+    # One fsync for every record written since the last one
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if self.file is not None and not self.file.closed:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        waiter, self.flush_waiter = self.flush_waiter, None
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    # Wait until everything written so far is on disk
+    async def synced(self):
+        if self.flush_waiter is not None:
+            await asyncio.shield(self.flush_waiter)
+
+    # Rewrite the log as one ledger record per chat plus the unsent messages
+    def compact(self):
+        if self.file is not None:
+            self.file.close()
+        temp_file = self.path + '.tmp'
+        with open(temp_file, 'w') as file:
+            for chat_id, keys in self.ledger.items():
+                file.write(json.dumps({'op': 'ledger', 'chat': chat_id, 'keys': list(keys)}) + '\n')
+            for record in self.unsent():
+                file.write(json.dumps(record) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_file, self.path)
+        self.log_lines = self.live_records()
+
+    def close(self):
+        self.flush()
+        if self.file is not None:
+            self.file.close()
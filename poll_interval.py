@@ -0,0 +1,83 @@
+import logging
+import math
+import os
+import time
+
+# Adaptive per-account polling: accounts that post often are polled near the floor,
+# dormant ones drift out to the ceiling
+interval_floor = float(os.getenv('POLL_INTERVAL_FLOOR', 15))
+interval_ceiling = float(os.getenv('POLL_INTERVAL_CEILING', 900))
+rate_half_life = float(os.getenv('POLL_RATE_HALF_LIFE', 1800))  # Seconds for an observation to lose half its weight
+target_posts_per_poll = float(os.getenv('POLL_TARGET_POSTS', 1))  # New posts we aim to find per poll
+
+# Exponentially weighted posting rate (posts per second) and the interval derived from it
+class AccountRate:
+    def __init__(self, rate, interval):
+        self.rate = rate
+        self.interval = interval
+        self.last_observed = None
+        self.last_polled = None
+        self.next_poll = 0.0
+
+class PollSchedule:
+    def __init__(self, initial_interval, floor=interval_floor, ceiling=interval_ceiling,
+                 half_life=rate_half_life, target_posts=target_posts_per_poll):
+        self.initial_interval = initial_interval
+        self.floor = floor
+        self.ceiling = ceiling
+        self.half_life = half_life
+        self.target_posts = target_posts
+        self.accounts = {}
+
+    def clamp(self, interval):
+        return min(max(interval, self.floor), self.ceiling)
+
+    def get(self, account):
+        if account not in self.accounts:
+            # Start from the rate that makes the old fixed interval the right one
+            interval = self.clamp(self.initial_interval)
+            self.accounts[account] = AccountRate(self.target_posts / interval, interval)
+        return self.accounts[account]
+
+    def interval(self, account):
+        return self.get(account).interval
+
+    # Accounts due for a poll; they are marked as polled so they are not handed out twice
+    def due(self, accounts, now=None):
+        now = time.time() if now is None else now
+        due_accounts = []
+        for account in accounts:
+            state = self.get(account)
+            if now >= state.next_poll:
+                state.last_polled = now
+                state.next_poll = now + state.interval
+                due_accounts.append(account)
+        return due_accounts
+
+    # Fold newly seen posts into the account's rate and reschedule its next poll
+    def record(self, account, new_posts, now=None):
+        now = time.time() if now is None else now
+        state = self.get(account)
+        elapsed = now - state.last_observed if state.last_observed is not None else 0.0
+        decay = 0.5 ** (elapsed / self.half_life)
+        state.rate = state.rate * decay + new_posts * math.log(2) / self.half_life
+        state.last_observed = now
+        state.interval = self.clamp(self.target_posts / state.rate) if state.rate > 0 else self.ceiling
+        state.next_poll = (state.last_polled or now) + state.interval
+
+    # Seconds until the next account in `accounts` is due
+    def next_due_in(self, accounts, now=None):
+        now = time.time() if now is None else now
+        if not accounts:
+            return self.floor
+        return max(min(self.get(account).next_poll for account in accounts) - now, 0.0)
+
+    # Current interval per account, in seconds
+    def intervals(self):
+        return {account: state.interval for account, state in self.accounts.items()}
+
+    def describe(self):
+        return ", ".join(f"{account}={interval:.0f}s" for account, interval in sorted(self.intervals().items()))
+
+    def log_intervals(self):
+        logging.debug(f"Poll intervals: {self.describe()}")
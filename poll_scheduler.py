@@ -0,0 +1,120 @@
+import heapq
+import itertools
+import logging
+import random
+import time
+from rate_limiter import default_window
+
+# A kind of poll job (tweets, likes, replies...) sharing one endpoint budget.
+# `budget` returns the endpoint's requests per rate window, so learned limits are picked up.
+class JobClass:
+    def __init__(self, name, priority, budget, window=default_window):
+        self.name = name
+        self.priority = priority
+        self.budget = budget
+        self.window = window
+        self.next_slot = 0.0
+        self.lags = []
+
+    # Seconds between dispatches that spread the budget evenly over the window
+    def spacing(self):
+        budget = self.budget()
+        return self.window / budget if budget else 0.0
+
+class ScheduledJob:
+    def __init__(self, account, job_class, due):
+        self.account = account
+        self.job_class = job_class
+        self.due = due  # When the job wanted to run, for lag reporting
+        self.heap_time = due  # When it is queued to run, later if its endpoint had no slot
+
+# Heap-ordered deadline scheduler for (account, job class) polls. Jobs run in due
+# order, higher priority (lower number) first on ties, and each job class is held
+# to its endpoint budget with jittered spacing instead of bursting at cycle boundaries.
+class PollScheduler:
+    def __init__(self, jitter=0.2):
+        self.jitter = jitter
+        self.classes = {}
+        self.jobs = {}
+        self.heap = []
+        self.counter = itertools.count()
+
+    def add_class(self, name, priority, budget, window=default_window):
+        self.classes[name] = JobClass(name, priority, budget, window)
+
+    def push(self, job, heap_time):
+        job.heap_time = heap_time
+        heapq.heappush(self.heap, (heap_time, self.classes[job.job_class].priority, next(self.counter), (job.account, job.job_class)))
+
+    def schedule(self, account, job_class, due):
+        job = ScheduledJob(account, job_class, due)
+        self.jobs[(account, job_class)] = job
+        self.push(job, due)
+
+    def remove(self, account, job_class):
+        # The heap entry is dropped lazily when it surfaces
+        self.jobs.pop((account, job_class), None)
+
+    # Make the scheduled jobs match `keys`: new ones are spread over their first interval
+    def sync(self, keys, interval, now=None):
+        now = time.time() if now is None else now
+        keys = set(keys)
+        for key in list(self.jobs):
+            if key not in keys:
+                self.remove(*key)
+        for account, job_class in keys:
+            if (account, job_class) not in self.jobs:
+                self.schedule(account, job_class, now + random.uniform(0, interval(account, job_class)))
+
+    # Pop every job that is due and has a slot in its endpoint budget; the rest are pushed back
+    def pop_ready(self, now=None):
+        now = time.time() if now is None else now
+        ready = []
+        while self.heap and self.heap[0][0] <= now:
+            heap_time, priority, _, key = heapq.heappop(self.heap)
+            job = self.jobs.get(key)
+            if job is None or job.heap_time != heap_time:
+                continue  # Removed or rescheduled since it was pushed
+            job_class = self.classes[job.job_class]
+            if job_class.next_slot > now:
+                self.push(job, job_class.next_slot)
+                continue
+            spacing = job_class.spacing()
+            job_class.next_slot = max(job_class.next_slot, now) + spacing * random.uniform(1 - self.jitter, 1 + self.jitter)
+            job_class.lags.append(now - job.due)
+            del self.jobs[key]
+            ready.append(key)
+        return ready
+
+    # Seconds until the next job could run
+    def next_wakeup(self, now=None):
+        now = time.time() if now is None else now
+        while self.heap and self.jobs.get(self.heap[0][3]) is None:
+            heapq.heappop(self.heap)
+        if not self.heap:
+            return None
+        return max(self.heap[0][0] - now, 0.0)
+
+    # How far behind schedule each job class ran since the last report, plus what is overdue now
+    def lag_report(self, now=None):
+        now = time.time() if now is None else now
+        report = {}
+        for name, job_class in self.classes.items():
+            overdue = [now - job.due for job in self.jobs.values() if job.job_class == name and job.due <= now]
+            lags = job_class.lags
+            report[name] = {
+                "dispatched": len(lags),
+                "mean_lag": sum(lags) / len(lags) if lags else 0.0,
+                "max_lag": max(lags + overdue) if lags or overdue else 0.0,
+                "overdue": len(overdue),
+            }
+            job_class.lags = []
+        return report
+
+    def log_lag(self, now=None):
+        report = self.lag_report(now)
+        summary = ", ".join(
+            f"{name}: {item['dispatched']} run, mean lag {item['mean_lag']:.1f}s, max lag {item['max_lag']:.1f}s, {item['overdue']} overdue"
+            for name, item in report.items()
+        )
+        logging.info(f"Poll scheduler: {summary}")
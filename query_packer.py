@@ -0,0 +1,122 @@
+import logging
+import os
+from dotenv import load_dotenv
+from twitter_client import twitter_get
+from tweet_decoder import DecodedResponse, decode_response
+from watermarks import search_since_id
+
+# Load environment variables
+load_dotenv()
+
+# Twitter API setup
+bearer_token = os.getenv('TWITTER_BEARER_TOKEN')
+
+search_url = "https://api.twitter.com/2/tweets/search/recent"
+max_query_length = int(os.getenv('TWITTER_MAX_QUERY_LENGTH', 512))  # 512 on Basic, 4096 on Pro
+max_pages = int(os.getenv('TWITTER_SEARCH_MAX_PAGES', 5))
+
+# Greedily pack search terms into groups whose OR-joined query fits max_length
+def pack_terms(terms, max_length=max_query_length):
+    groups = []
+    current = []
+    length = 0
+    for term in terms:
+        if current and length + len(" OR ") + len(term) > max_length:
+            groups.append(current)
+            current = []
+        length = len(term) if not current else length + len(" OR ") + len(term)
+        current.append(term)
+    if current:
+        groups.append(current)
+    return groups
+
+# Polls many keys (user IDs, conversation IDs, ...) with as few search/recent calls as possible.
+# Each packed query keeps its own since_id and results are routed back to their key by `route_field`.
+# `since_ids` may be a persisted mapping (key -> since_id) that the packer reads and updates in place.
+class SearchPacker:
+    def __init__(self, operator, route_field, max_length=max_query_length, since_ids=None):
+        self.operator = operator
+        self.route_field = route_field
+        self.max_length = max_length
+        self.queries = {}
+        self.query_since_ids = {}
+        self.keys = set()
+        self.key_since_ids = since_ids if since_ids is not None else {}
+
+    def set_keys(self, keys):
+        keys = sorted({str(key) for key in keys if key})
+        groups = pack_terms([f"{self.operator}:{key}" for key in keys], self.max_length)
+        queries = {}
+        for group in groups:
+            query = " OR ".join(group)
+            queries[query] = [term.split(':', 1)[1] for term in group]
+        # Queries that survived a repack keep their watermark; new ones start from their keys' oldest
+        since_ids = {}
+        for query, members in queries.items():
+            if query in self.query_since_ids:
+                since_ids[query] = self.query_since_ids[query]
+            else:
+                member_since_ids = [self.key_since_ids.get(key) for key in members]
+                since_ids[query] = None if None in member_since_ids else min(member_since_ids, key=int)
+        self.queries = queries
+        self.query_since_ids = since_ids
+        # Watermarks of keys that left are kept, so a key that comes back resumes where it stopped
+        self.keys = set(keys)
+        for key in keys:
+            self.key_since_ids.setdefault(key, None)
+
+    # Run every packed query once; returns ({key: [tweets newest first]}, merged decoded response)
+    async def poll(self, params=None):
+        routed = {}
+        merged = DecodedResponse({})
+        for query, members in self.queries.items():
+            decoded = await search_recent(query, self.query_since_ids[query], params)
+            if decoded is None:
+                continue
+            merged.merge(decoded)
+            if decoded.data:
+                self.query_since_ids[query] = max((tweet['id'] for tweet in decoded.data), key=int)
+            for tweet in decoded.data:
+                key = tweet.get(self.route_field)
+                if key not in self.keys:
+                    continue
+                # A repacked query may return tweets a key has already seen
+                key_since_id = self.key_since_ids[key]
+                if key_since_id and int(tweet['id']) <= int(key_since_id):
+                    continue
+                routed.setdefault(key, []).append(tweet)
+        for key, tweets in routed.items():
+            tweets.sort(key=lambda tweet: int(tweet['id']), reverse=True)
+            self.key_since_ids[key] = tweets[0]['id']
+        logging.debug(f"Polled {len(self.keys)} keys with {len(self.queries)} packed {self.operator}: queries")
+        return routed, merged
+
+# Run one search/recent query, following next_token pages; None on failure
+async def search_recent(query, since_id=None, params=None):
+    headers = {
+        "Authorization": f"Bearer {bearer_token}"
+    }
+    since_id = search_since_id(since_id)  # A watermark older than the search window would be a 400
+    request_params = {
+        "query": query,
+        "since_id": since_id,
+        "max_results": 100,
+        **(params or {})
+    }
+    merged = None
+    for page in range(max_pages):
+        response = await twitter_get(search_url, headers=headers, params=request_params)
+        if response.status_code != 200:
+            logging.error(f"Failed packed search ({len(query)} chars): {response.status_code} {response.text}")
+            return None  # Keep the old since_id rather than skipping unread pages
+        decoded = decode_response(response.json())
+        if merged is None:
+            merged = decoded
+        else:
+            merged.merge(decoded)
+        next_token = decoded.meta.get('next_token')
+        # Without a since_id only the newest page matters
+        if not next_token or not since_id:
+            break
+        request_params['next_token'] = next_token
+    return merged
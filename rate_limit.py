@@ -1,14 +1,23 @@
 import logging
 import asyncio
-import requests
 from telethon import TelegramClient, events, Button
 import os
 from dotenv import load_dotenv
 from user_manager import save_chat_id, get_user_chat_ids
+from twitter_client import twitter_get, close_session, take_transfer_stats, format_transfer_stats
+from user_resolver import resolve_user_id, resolve_user_ids, resolve_username
+from field_profiles import profile_params
+from query_packer import SearchPacker
+from poll_interval import PollSchedule
+from poll_scheduler import PollScheduler
+from token_pool import pool_limit
+from subscriptions import SubscriptionRegistry
+from task_commands import register_task_commands
+from worker_pool import WorkerPool
+from delivery import get_delivery
+from watermarks import watermark_view, save_watermarks
+from stream_ingest import StreamIngest
 import time
-from datetime import datetime, timedelta
-import queue
-import threading
 
 # Setup logging
 logging.basicConfig(level=logging.DEBUG)
@@ -58,6 +67,7 @@ async def monitor_handler(event):
 @telegram_client.on(events.NewMessage(pattern='🚫 Stop Monitoring'))
 async def stop_monitoring_handler(event):
     user_monitoring_states[event.chat_id] = False  # Set monitoring state to False for this user
+    subscriptions.unsubscribe_chat(event.chat_id)  # Accounts nobody else follows stop being polled
     await event.respond("Stopping monitoring...")
     print(f"Monitoring stopped for chat ID: {event.chat_id}")
 
@@ -74,94 +84,106 @@ async def settings_handler(event):
 # Handler for other messages (e.g., Twitter usernames input)
 @telegram_client.on(events.NewMessage)
 async def username_handler(event):
+    if event.message.message.startswith('/'):
+        return  # Commands have their own handlers
     if user_monitoring_states.get(event.chat_id, False):
         usernames = event.message.message.strip().replace('@', '').split(',')
+        for username in usernames:
+            subscriptions.subscribe(event.chat_id, username)
         await event.respond(f"Monitoring accounts: {', '.join(usernames)}...")
-        asyncio.create_task(monitor_accounts(usernames, event))
+        ensure_monitoring()
     else:
         await event.respond("Monitoring is currently stopped. Please start monitoring first.")
 
-# Initialize cache and message queue
-tweet_cache = {}
-cache_duration = timedelta(minutes=15)  # Cache duration
-tweet_queue = queue.Queue()
+# Twitter fetch jobs run on the main loop, several at a time, through a bounded queue
+worker_pool = WorkerPool()
 
-# Worker function to process queue
-def tweet_worker():
-    while True:
-        item = tweet_queue.get()
-        if item is None:
-            break
-        asyncio.run(process_queue_item(item))
-        tweet_queue.task_done()
+# Add tasks to queue; waits while the queue is full
+async def add_task_to_queue(task, *args, key=None):
+    await worker_pool.submit(task, *args, key=key)
 
-async def process_queue_item(item):
-    await item[0](*item[1:])
+# Stop the producers, let queued jobs finish, then close the pooled Twitter session
+async def shutdown():
+    producers = [task for task in (monitor_task, stream_task) if task is not None]
+    for task in producers:
+        task.cancel()
+    await asyncio.gather(*producers, return_exceptions=True)
+    await worker_pool.stop()
+    await close_session()
+    get_delivery(telegram_client).close()
+    save_watermarks()
 
-# Start worker thread
-worker_thread = threading.Thread(target=tweet_worker)
-worker_thread.start()
+# Followed accounts and the chats subscribed to each, shared by every chat
+subscriptions = SubscriptionRegistry()
+register_task_commands(telegram_client, subscriptions)  # /tasks, /pause, /resume, /cancel
+monitor_task = None
+stream_task = None
+last_tweet_ids = watermark_view('tweets')  # Newest tweet delivered per account, by the stream or a poll; persisted
 
-# Add tasks to queue
-def add_task_to_queue(task, *args):
-    tweet_queue.put((task, *args))
+# One poller and one filtered stream for the whole bot, started by the first subscription
+def ensure_monitoring():
+    global monitor_task, stream_task
+    if monitor_task is None or monitor_task.done():
+        monitor_task = asyncio.create_task(monitor_accounts())
+    if stream_task is None or stream_task.done():
+        stream_task = asyncio.create_task(stream_ingest.run())
 
-# Stop the worker thread gracefully
-def stop_worker_thread():
-    tweet_queue.put(None)
-    worker_thread.join()
+# Send a notification about an account to every chat that follows it
+async def notify_subscribers(username, message, **kwargs):
+    await subscriptions.notify(telegram_client, username, message, **kwargs)
 
 # Monitor multiple accounts for tweets, replies, and likes
-async def monitor_accounts(usernames, event):
-    last_tweet_ids = {username: None for username in usernames}
-    last_reply_ids = {username: None for username in usernames}
-    last_like_ids = {username: None for username in usernames}
+async def monitor_accounts():
+    reply_packer = SearchPacker('from', 'author_id', since_ids=watermark_view('replies'))  # Replies for many accounts per search call
+    poll_schedule = PollSchedule(30)  # Per-account intervals, starting from the old fixed one
+    reply_interval = 30  # One packed search covers every account, so replies keep a fixed cadence
+    # Each job class is held to its endpoint's budget summed over the token pool: learned from the API, defaults until the first response
+    scheduler = PollScheduler()
+    scheduler.add_class('tweets', 0, lambda: pool_limit(bearer_token, '/2/users/:id/tweets', 1500))
+    scheduler.add_class('replies', 1, lambda: pool_limit(bearer_token, '/2/tweets/search/recent', 450))
+    scheduler.add_class('likes', 2, lambda: pool_limit(oauth_token, '/2/users/:id/liked_tweets', 75))
+
+    def interval(username, job_class):
+        return reply_interval if job_class == 'replies' else poll_schedule.interval(username)
+
+    # since_ids are persisted, so the first poll after a restart only brings back new items
+    last_like_ids = watermark_view('likes')
     while True:
+        usernames = subscriptions.accounts()  # Each followed account once, however many chats follow it
         for username in usernames:
-            add_task_to_queue(monitor_account, username, last_tweet_ids, last_reply_ids, last_like_ids, event)
-        await asyncio.sleep(30)  # Check for updates every 1 seconds
-
-async def monitor_account(username, last_tweet_ids, last_reply_ids, last_like_ids, event):
-    user_id = await fetch_user_id(username)
-    if user_id:
-        add_task_to_queue(fetch_tweets, user_id, username, last_tweet_ids, event)
-        add_task_to_queue(fetch_replies, user_id, username, last_reply_ids, event)
-        add_task_to_queue(fetch_likes, user_id, username, last_like_ids, event)
+            last_tweet_ids.setdefault(username, None)
+            last_like_ids.setdefault(username, None)
+        jobs = [(username, job_class) for username in usernames for job_class in ('tweets', 'likes')]
+        if usernames:
+            jobs.append((None, 'replies'))
+        scheduler.sync(jobs, interval)
+        user_ids = await resolve_user_ids(usernames)  # One batched lookup per 100 accounts
+        # Only accounts that exist get a rule; anything else a chat typed would be rejected by the API.
+        # The rules are synced on the stream's own task, off the dispatch path.
+        stream_ingest.want_rules(username for username in usernames if user_ids[username])
+        now = time.time()
+        for username, job_class in scheduler.pop_ready(now):
+            if job_class == 'tweets' and stream_ingest.covers(username):
+                pass  # Arrives over the filtered stream
+            elif job_class == 'tweets' and user_ids[username]:
+                await add_task_to_queue(fetch_tweets, user_ids[username], username, last_tweet_ids, poll_schedule, key=(username, job_class))
+            elif job_class == 'likes' and user_ids[username]:
+                await add_task_to_queue(fetch_likes, user_ids[username], username, last_like_ids, key=(username, job_class))
+            elif job_class == 'replies':
+                await add_task_to_queue(fetch_replies, reply_packer, user_ids, poll_schedule, key=(username, job_class))
+                poll_schedule.log_intervals()
+                scheduler.log_lag(now)
+                worker_pool.log_stats()
+                get_delivery(telegram_client).log_stats()
+                logging.info(stream_ingest.describe(usernames))
+                logging.info(f"Twitter transfer this cycle: {format_transfer_stats(take_transfer_stats())}")
+            scheduler.schedule(username, job_class, now + interval(username, job_class))
+        # Sleep until the next job is due, waking early when a chat subscribes, pauses or cancels
+        wakeup = scheduler.next_wakeup()
+        await subscriptions.wait_for_change(min(max(wakeup, 0.1), 60) if wakeup is not None else 60)
 
 async def fetch_user_id(username):
-    headers = {
-        "Authorization": f"Bearer {bearer_token}"
-    }
-    user_url = f"https://api.twitter.com/2/users/by/username/{username}"
-    backoff_time = 10
-    while True:
-        user_response = requests.get(user_url, headers=headers)
-        
-        logging.debug(f"Twitter API response status code: {user_response.status_code}")
-        logging.debug(f"Twitter API response headers: {user_response.headers}")
-        
-        if user_response.status_code == 429:
-            reset_time = int(user_response.headers["x-rate-limit-reset"])
-            current_time = time.time()
-            sleep_time = reset_time - current_time
-            logging.info(f"Rate limit hit. Sleeping for {sleep_time} seconds.")
-            await asyncio.sleep(sleep_time)
-        elif user_response.status_code == 404:
-            logging.error(f"Username '{username}' not found.")
-            return None
-        elif user_response.status_code == 200:
-            try:
-                user_id = user_response.json().get('data', {}).get('id', None)
-                return user_id
-            except ValueError:
-                logging.error("Failed to decode JSON response.")
-                return None
-        else:
-            logging.error(f"Failed to fetch user ID: {user_response.text}")
-            await asyncio.sleep(backoff_time)
-            backoff_time = min(backoff_time * 2, 320)  # Exponential backoff
-
-    return None
+    return await resolve_user_id(username)
 
 # Function to shorten text to 4 lines
 def shorten_text(text, max_lines=4):
@@ -170,88 +192,93 @@ def shorten_text(text, max_lines=4):
         return text
     return '\n'.join(lines[:max_lines]) + '…'
 
+def tweet_message(username, tweet):
+    tweet_link = f"https://twitter.com/{username}/status/{tweet['id']}"
+    timestamp = time.strftime("%I:%M %p", time.localtime(time.time()))
+    return (f"Tweet | {username} | [Post Link]({tweet_link})\n\n"
+            f"{shorten_text(tweet['text'])}\n\n"
+            f"X (formerly Twitter)\n"
+            f"@{username} on X\n"
+            f"Read more: [View on X]({tweet_link})\n"
+            f"{timestamp}")
+
+# Tweets matched by the filtered stream; skips any a fallback poll already delivered
+async def deliver_stream_tweet(username, tweet):
+    if not subscriptions.is_followed(username):
+        return
+    last_id = last_tweet_ids.get(username)
+    if last_id and int(tweet['id']) <= int(last_id):
+        return
+    last_tweet_ids[username] = tweet['id']
+    await notify_subscribers(username, tweet_message(username, tweet), kind="Tweet", item_id=tweet['id'])
+
+stream_ingest = StreamIngest(bearer_token, deliver_stream_tweet)
+
 # Fetch tweets and send them to Telegram with shortened text
-async def fetch_tweets(user_id, username, last_tweet_ids, event):
-    now = datetime.now()
-    if username in tweet_cache and now - tweet_cache[username]['timestamp'] < cache_duration:
-        tweets = tweet_cache[username]['data']
+async def fetch_tweets(user_id, username, last_tweet_ids, poll_schedule):
+    if not subscriptions.is_followed(username):
+        return  # Cancelled or paused while the job was queued
+    headers = {
+        "Authorization": f"Bearer {bearer_token}"
+    }
+    params = {
+        "since_id": last_tweet_ids[username],
+        "max_results": 10
+    } if last_tweet_ids[username] else {"max_results": 10}
+    tweets_url = f"https://api.twitter.com/2/users/{user_id}/tweets"
+    started = time.time()
+    tweets_response = await twitter_get(tweets_url, headers=headers, params=params)
+    
+    if tweets_response.status_code == 200:
+        tweets = tweets_response.json().get('data', [])
+        if last_tweet_ids[username]:  # The first fetch returns backlog, not new posts
+            poll_schedule.record(username, len(tweets))
     else:
-        headers = {
-            "Authorization": f"Bearer {bearer_token}"
-        }
-        params = {
-            "since_id": last_tweet_ids[username],
-            "max_results": 10
-        } if last_tweet_ids[username] else {"max_results": 10}
-        tweets_url = f"https://api.twitter.com/2/users/{user_id}/tweets"
-        tweets_response = requests.get(tweets_url, headers=headers, params=params)
-        
-        if tweets_response.status_code == 200:
-            tweets = tweets_response.json().get('data', [])
-            tweet_cache[username] = {'data': tweets, 'timestamp': now}
-        else:
-            logging.error(f"Failed to fetch tweets: {tweets_response.json()}")
-            return
+        logging.error(f"Failed to fetch tweets: {tweets_response.json()}")
+        return
     
+    last_id = last_tweet_ids[username]
+    tweets = [tweet for tweet in tweets if not last_id or int(tweet['id']) > int(last_id)]  # The stream may have got there first
     if tweets:
         for tweet in tweets:
-            text = shorten_text(tweet['text'])
-            tweet_link = f"https://twitter.com/{username}/status/{tweet['id']}"
-            timestamp = time.strftime("%I:%M %p", time.localtime(time.time()))
-
-            await event.respond(f"Tweet | {username} | [Post Link]({tweet_link})\n\n"
-                                f"{text}\n\n"
-                                f"X (formerly Twitter)\n"
-                                f"@{username} on X\n"
-                                f"Read more: [View on X]({tweet_link})\n"
-                                f"{timestamp}")
+            await notify_subscribers(username, tweet_message(username, tweet), kind="Tweet", item_id=tweet['id'])
             
         last_tweet_ids[username] = tweets[0]['id']
-async def fetch_replies(user_id, username, last_reply_ids, event):
-    headers = {
-        "Authorization": f"Bearer {bearer_token}"
-    }
-    params = {
-        "since_id": last_reply_ids[username],
-        "max_results": 10
-    } if last_reply_ids[username] else {"max_results": 10}
-    replies_url = f"https://api.twitter.com/2/tweets/search/recent?query=from:{user_id}&tweet.fields=conversation_id,author_id,in_reply_to_user_id"
-    replies_response = requests.get(replies_url, headers=headers, params=params)
-    if replies_response.status_code == 200:
-        replies = replies_response.json().get('data', [])
-        if replies:
-            for reply in replies:
-                in_reply_to_user_id = reply.get('in_reply_to_user_id')
-                tweet_link = f"https://twitter.com/{username}/status/{reply['id']}"
-                timestamp = time.strftime("%I:%M %p", time.localtime(time.time()))
-                if in_reply_to_user_id:
-                    post_owner = await fetch_username(in_reply_to_user_id)
-                    await event.respond(f"Reply | {username} | [Post Link]({tweet_link})\n\n"
-                                        f"{reply['text']}\n\n"
-                                        f"Reply to @{post_owner}\n"
-                                        f"Read more: [View on X]({tweet_link})\n"
-                                        f"{timestamp}")
-                else:
-                    await event.respond(f"Reply | @{username} | [Post Link]({tweet_link})\n\n"
-                                        f"{reply['text']}\n"
-                                        f"Read more: [View on X]({tweet_link})\n"
-                                        f"{timestamp}")
-            last_reply_ids[username] = replies[0]['id']
+    stream_ingest.mark_polled(username, started)  # After the watermark moved, so released stream tweets come after these
+# Fetch replies for all accounts with packed from: searches and route them back by author
+async def fetch_replies(reply_packer, user_ids, poll_schedule):
+    reply_packer.set_keys(user_ids.values())
+    usernames_by_id = {user_id: username for username, user_id in user_ids.items() if user_id}
+    primed = {user_id for user_id, since_id in reply_packer.key_since_ids.items() if since_id}
+    replies_by_author, decoded = await reply_packer.poll(profile_params("reply"))
+    for user_id, replies in replies_by_author.items():
+        username = usernames_by_id[user_id]
+        if user_id in primed:
+            poll_schedule.record(username, len(replies))  # Replies are posts too
+        for reply in replies:
+            in_reply_to_user_id = reply.get('in_reply_to_user_id')
+            tweet_link = f"https://twitter.com/{username}/status/{reply['id']}"
+            timestamp = time.strftime("%I:%M %p", time.localtime(time.time()))
+            if in_reply_to_user_id:
+                post_owner = decoded.post_owner(reply) or await fetch_username(in_reply_to_user_id)
+                await notify_subscribers(username, f"Reply | {username} | [Post Link]({tweet_link})\n\n"
+                                                   f"{reply['text']}\n\n"
+                                                   f"Reply to @{post_owner}\n"
+                                                   f"Read more: [View on X]({tweet_link})\n"
+                                                   f"{timestamp}", kind="Reply", item_id=reply['id'])
+            else:
+                await notify_subscribers(username, f"Reply | @{username} | [Post Link]({tweet_link})\n\n"
+                                                   f"{reply['text']}\n"
+                                                   f"Read more: [View on X]({tweet_link})\n"
+                                                   f"{timestamp}", kind="Reply", item_id=reply['id'])
 
 
 async def fetch_username(user_id):
-    headers = {
-        "Authorization": f"Bearer {bearer_token}"
-    }
-    url = f"https://api.twitter.com/2/users/{user_id}"
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        user_data = response.json().get('data', {})
-        username = user_data.get('username', 'unknown_user')
-        return username
-    return 'unknown_user'
-
-async def fetch_likes(user_id, username, last_like_ids, event):
+    return await resolve_username(user_id) or 'unknown_user'
+
+async def fetch_likes(user_id, username, last_like_ids):
+    if not subscriptions.is_followed(username):
+        return  # Cancelled or paused while the job was queued
     headers = {
         "Authorization": f"Bearer {oauth_token}"
     }
@@ -260,21 +287,22 @@ async def fetch_likes(user_id, username, last_like_ids, event):
         "max_results": 10
     } if last_like_ids[username] else {"max_results": 10}
     likes_url = f"https://api.twitter.com/2/users/{user_id}/liked_tweets"
-    likes_response = requests.get(likes_url, headers=headers, params=params)
+    likes_response = await twitter_get(likes_url, headers=headers, params=params)
     if likes_response.status_code == 200:
         likes = likes_response.json().get('data', [])
         if likes:
             for like in likes:
                 tweet_link = f"https://twitter.com/{username}/status/{like['id']}"
                 timestamp = time.strftime("%I:%M %p", time.localtime(time.time()))
-                await event.respond(f"Like | @{username} | [Post Link]({tweet_link})\n\n"
-                                    f"{like['text']}\n"
-                                    f"Read more: [View on X]({tweet_link})\n"
-                                    f"{timestamp}")
+                await notify_subscribers(username, f"Like | @{username} | [Post Link]({tweet_link})\n\n"
+                                                   f"{like['text']}\n"
+                                                   f"Read more: [View on X]({tweet_link})\n"
+                                                   f"{timestamp}", kind="Like", item_id=like['id'])
             last_like_ids[username] = likes[0]['id']
 
 if __name__ == "__main__":
+    telegram_client.loop.create_task(get_delivery(telegram_client).resume())  # Notifications a previous run left unsent
     telegram_client.run_until_disconnected()
 
-    # Gracefully stop the worker thread
-    stop_worker_thread()
+    # Let the workers finish their queued jobs
+    telegram_client.loop.run_until_complete(shutdown())
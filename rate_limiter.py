@@ -0,0 +1,158 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+
+# Proactive Twitter API rate limiting per (token, endpoint), fed by x-rate-limit-* headers
+state_file = os.getenv('RATE_LIMIT_STATE_FILE', 'rate_limits.json')
+burst_size = int(os.getenv('RATE_LIMIT_BURST', 5))  # Requests allowed back to back before pacing kicks in
+default_window = 15 * 60  # Twitter rate limit windows are 15 minutes
+flush_interval = 5  # Seconds between state file writes
+budget_share = 1.0  # Fraction of every budget this process may spend, below 1 when shard processes share the tokens
+
+# Collapse IDs and handles so every user shares one budget per endpoint
+endpoint_patterns = [
+    (re.compile(r'/by/username/[^/]+'), '/by/username/:username'),
+    (re.compile(r'/\d{4,}(?=/|$)'), '/:id'),  # Numeric user and tweet IDs, not the API version
+]
+
+def endpoint_for(url):
+    path = re.sub(r'^https?://[^/]+', '', url).split('?', 1)[0]
+    for pattern, replacement in endpoint_patterns:
+        path = pattern.sub(replacement, path)
+    return path
+
+# Tokens are never written to disk, only a short fingerprint
+def token_key(token):
+    return hashlib.sha256((token or '').encode()).hexdigest()[:12]
+
+def token_from_headers(headers):
+    authorization = (headers or {}).get('Authorization', '')
+    return authorization[len('Bearer '):] if authorization.startswith('Bearer ') else authorization
+
+# Budget for one (token, endpoint) pair within the current rate limit window
+class EndpointBudget:
+    def __init__(self, limit=None, remaining=None, reset=None):
+        self.limit = limit
+        self.remaining = remaining
+        self.reset = reset
+        self.next_slot = 0.0
+
+    def known(self):
+        return self.remaining is not None and self.reset is not None
+
+    def roll_window(self, now):
+        if self.known() and now >= self.reset:
+            self.remaining = self.limit
+            self.reset = now + default_window
+
+    # Reserve the next request slot; returns (seconds to wait, whether a slot was reserved)
+    def reserve(self, now):
+        self.roll_window(now)
+        if not self.known():
+            return 0.0, True
+        if self.remaining <= 0:
+            # The window is spent: wait for the reset instead of spending a request that would 429
+            return max(self.reset - now, 0.0), False
+        # Spread this process's share of what is left of the budget evenly over what is left of the window
+        interval = max(self.reset - max(self.next_slot, now), 0) / max(self.remaining * budget_share, 1)
+        slot = max(self.next_slot, now - burst_size * interval)
+        self.next_slot = slot + interval
+        self.remaining -= 1
+        return max(slot - now, 0.0), True
+
+    def to_dict(self):
+        return {"limit": self.limit, "remaining": self.remaining, "reset": self.reset}
+
+# Pace this process as if only `share` of each window were left to it
+def set_budget_share(share):
+    global budget_share
+    budget_share = share
+
+budgets = {}
+last_flush = 0.0
+dirty = False
+
+def get_budget(token, endpoint):
+    key = f"{token_key(token)} {endpoint}"
+    if key not in budgets:
+        budgets[key] = EndpointBudget()
+    return budgets[key]
+
+# Requests per window last reported for an endpoint, or `default` before the first response
+def endpoint_limit(token, endpoint, default=None):
+    budget = budgets.get(f"{token_key(token)} {endpoint}")
+    return budget.limit if budget is not None and budget.limit else default
+
+# Wait until a request to this endpoint is within budget
+async def acquire(token, url):
+    endpoint = endpoint_for(url)
+    budget = get_budget(token, endpoint)
+    while True:
+        wait_time, reserved = budget.reserve(time.time())
+        if not reserved:
+            logging.info(f"Rate limit budget for {endpoint} spent. Waiting {wait_time:.0f} seconds for reset.")
+        if wait_time > 0:
+            await asyncio.sleep(wait_time)
+        if reserved:
+            return
+
+# Record the budget reported by a response
+def update(token, url, status_code, headers):
+    global dirty
+    budget = get_budget(token, endpoint_for(url))
+    limit = headers.get('x-rate-limit-limit')
+    remaining = headers.get('x-rate-limit-remaining')
+    reset = headers.get('x-rate-limit-reset')
+    if limit is not None:
+        budget.limit = int(limit)
+    if reset is not None:
+        budget.reset = int(reset)
+    if remaining is not None:
+        budget.remaining = int(remaining)
+    if status_code == 429:
+        budget.remaining = 0
+        if budget.reset is None or budget.reset <= time.time():
+            budget.reset = time.time() + default_window
+    dirty = True
+    if time.time() - last_flush >= flush_interval:
+        save_rate_limits()
+
+# Current budgets for reporting, keyed by "token_fingerprint endpoint"
+def rate_limit_snapshot():
+    return {key: budget.to_dict() for key, budget in budgets.items() if budget.known()}
+
+def save_rate_limits():
+    global last_flush, dirty
+    last_flush = time.time()
+    if not dirty:
+        return
+    # Shard processes share the state file, so each writes through its own temp file
+    fd, temp_file = tempfile.mkstemp(prefix=os.path.basename(state_file) + '.', dir=os.path.dirname(os.path.abspath(state_file)))
+    with os.fdopen(fd, 'w') as file:
+        json.dump(rate_limit_snapshot(), file)
+    os.replace(temp_file, state_file)
+    dirty = False
+
+def load_rate_limits():
+    if not os.path.exists(state_file):
+        return
+    try:
+        with open(state_file, 'r') as file:
+            saved = json.load(file)
+    except ValueError:
+        logging.error(f"Ignoring corrupt rate limit state in {state_file}")
+        return
+    now = time.time()
+    for key, values in saved.items():
+        # Windows that already reset carry no information
+        if values.get('reset') and values['reset'] > now:
+            budgets[key] = EndpointBudget(values.get('limit'), values.get('remaining'), values['reset'])
+    logging.info(f"Loaded {len(budgets)} rate limit budgets from {state_file}")
+
+# Load persisted budgets at the start
+load_rate_limits()
@@ -0,0 +1,112 @@
+import bisect
+import hashlib
+import logging
+import multiprocessing
+import os
+from shard_worker import run_shard_worker
+
+virtual_nodes = int(os.getenv('SHARD_VIRTUAL_NODES', 100))  # Ring points per worker, more means a more even split
+
+def ring_hash(key):
+    return int(hashlib.md5(str(key).encode()).hexdigest()[:16], 16)
+
+# Consistent hash ring: adding a worker only takes over the keys that land on its points,
+# roughly 1/N of them, and leaves every other assignment alone
+class HashRing:
+    def __init__(self, replicas=virtual_nodes):
+        self.replicas = replicas
+        self.points = []  # Sorted (hash, worker ID)
+
+    def add(self, worker_id):
+        for replica in range(self.replicas):
+            bisect.insort(self.points, (ring_hash(f"shard-{worker_id}#{replica}"), worker_id))
+
+    def remove(self, worker_id):
+        self.points = [point for point in self.points if point[1] != worker_id]
+
+    def owner(self, key):
+        if not self.points:
+            return None
+        index = bisect.bisect(self.points, (ring_hash(key),)) % len(self.points)
+        return self.points[index][1]
+
+# Splits the monitored accounts across ingest processes by consistent hashing of user ID.
+# Every worker feeds one shared delivery queue, which only the supervising process reads.
+class ShardSupervisor:
+    def __init__(self):
+        self.context = multiprocessing.get_context('spawn')
+        self.deliveries = self.context.Queue()
+        self.ring = HashRing()
+        self.workers = {}  # worker ID -> (process, command queue)
+        self.owners = {}  # username -> worker ID
+        self.user_ids = {}  # username -> user ID for every account to poll
+
+    def spawn(self, worker_id):
+        commands = self.context.Queue()
+        process = self.context.Process(target=run_shard_worker, args=(worker_id, commands, self.deliveries), daemon=True)
+        process.start()
+        self.workers[worker_id] = (process, commands)
+
+    def send(self, worker_id, command):
+        self.workers[worker_id][1].put(command)
+
+    # Start one more ingest process and move the accounts that now hash to it
+    def add_worker(self):
+        worker_id = max(self.workers, default=-1) + 1
+        self.spawn(worker_id)
+        self.ring.add(worker_id)
+        for other in self.workers:
+            self.send(other, ('shards', len(self.workers)))  # Everyone's slice of the API budget shrinks
+        moved = self.rebalance()
+        logging.info(f"Added shard worker {worker_id}; moved {moved} of {len(self.owners)} accounts")
+        return worker_id
+
+    # Set the accounts to poll ({username: user_id}); unresolved accounts are skipped
+    def assign(self, user_ids):
+        self.user_ids = {username: user_id for username, user_id in user_ids.items() if user_id}
+        self.rebalance()
+
+    # Bring worker assignments in line with the ring; returns how many accounts changed workers
+    def rebalance(self):
+        moved = 0
+        for username in list(self.owners):
+            if username not in self.user_ids:
+                self.send(self.owners.pop(username), ('remove', username))
+        for username, user_id in self.user_ids.items():
+            owner = self.ring.owner(user_id)
+            current = self.owners.get(username)
+            if owner is None or owner == current:
+                continue
+            if current is not None:
+                self.send(current, ('remove', username))
+                moved += 1
+            # A moved account primes its watermarks first so its backlog is not delivered twice
+            self.send(owner, ('add', username, user_id, current is not None))
+            self.owners[username] = owner
+        return moved
+
+    # Respawn crashed workers under the same ID, so the ring and assignments stay put
+    def restart_dead_workers(self):
+        for worker_id, (process, _) in list(self.workers.items()):
+            if process.is_alive():
+                continue
+            logging.error(f"Shard worker {worker_id} exited with code {process.exitcode}; restarting")
+            self.spawn(worker_id)
+            self.send(worker_id, ('shards', len(self.workers)))
+            for username, owner in self.owners.items():
+                if owner == worker_id:
+                    self.send(worker_id, ('add', username, self.user_ids[username], True))
+
+    # Number of accounts per worker
+    def shard_sizes(self):
+        sizes = {worker_id: 0 for worker_id in self.workers}
+        for owner in self.owners.values():
+            sizes[owner] += 1
+        return sizes
+
+    def stop(self, timeout=30):
+        for worker_id in self.workers:
+            self.send(worker_id, ('stop',))
+        for process, _ in self.workers.values():
+            process.join(timeout)
+        self.deliveries.put(None)  # Ends the delivery loop
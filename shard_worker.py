@@ -0,0 +1,226 @@
+import asyncio
+import logging
+import os
+import time
+from dotenv import load_dotenv
+from twitter_client import twitter_get, close_session, take_transfer_stats, format_transfer_stats
+from user_resolver import resolve_username
+from field_profiles import profile_params
+from query_packer import SearchPacker
+from poll_interval import PollSchedule
+from poll_scheduler import PollScheduler
+from token_pool import pool_limit
+from rate_limiter import set_budget_share
+from worker_pool import WorkerPool
+
+# Load environment variables
+load_dotenv()
+
+# Twitter API setup
+bearer_token = os.getenv('TWITTER_BEARER_TOKEN')
+oauth_token = os.getenv('TWITTER_OAUTH_TOKEN')
+
+poll_interval = int(os.getenv('SHARD_POLL_INTERVAL', 30))
+
+# Function to shorten text to 4 lines
+def shorten_text(text, max_lines=4):
+    lines = text.split('\n')
+    if len(lines) <= max_lines:
+        return text
+    return '\n'.join(lines[:max_lines]) + '…'
+
+# Ingest process for one shard of the monitored accounts. It polls only the accounts the
+# supervisor assigned to it and hands rendered notifications back on the delivery queue;
+# it never talks to Telegram itself.
+class ShardWorker:
+    def __init__(self, worker_id, commands, deliveries):
+        self.worker_id = worker_id
+        self.commands = commands
+        self.deliveries = deliveries
+        self.user_ids = {}  # username -> user ID for the accounts in this shard
+        self.unprimed = {}  # username -> job classes whose first fetch must not be delivered
+        # Watermarks stay in memory: accounts move between shards, and the supervisor re-adds a
+        # dead worker's accounts to be primed, so their backlog is skipped rather than redelivered
+        self.last_tweet_ids = {}
+        self.last_like_ids = {}
+        self.reply_packer = SearchPacker('from', 'author_id')
+        self.poll_schedule = PollSchedule(poll_interval)
+        self.shard_count = 1  # Processes splitting the token pool's budgets, set by the supervisor
+        self.scheduler = PollScheduler()
+        self.scheduler.add_class('tweets', 0, lambda: pool_limit(bearer_token, '/2/users/:id/tweets', 1500) / self.shard_count)
+        self.scheduler.add_class('replies', 1, lambda: pool_limit(bearer_token, '/2/tweets/search/recent', 450) / self.shard_count)
+        self.scheduler.add_class('likes', 2, lambda: pool_limit(oauth_token, '/2/users/:id/liked_tweets', 75) / self.shard_count)
+        self.worker_pool = WorkerPool()
+        self.changed = asyncio.Event()
+
+    # Apply one supervisor command: ('add', username, user_id, moved), ('remove', username),
+    # ('shards', count) or ('stop',)
+    def apply_command(self, command):
+        if command[0] == 'shards':
+            # Every worker spends the same tokens, so each keeps to an equal slice of their budgets
+            self.shard_count = command[1]
+            set_budget_share(1 / command[1])
+        elif command[0] == 'add':
+            _, username, user_id, moved = command
+            self.user_ids[username] = user_id
+            self.last_tweet_ids.setdefault(username, None)
+            self.last_like_ids.setdefault(username, None)
+            if moved:
+                # Another worker already delivered this account's backlog
+                self.unprimed[username] = {'tweets', 'replies', 'likes'}
+        elif command[0] == 'remove':
+            username = command[1]
+            user_id = self.user_ids.pop(username, None)
+            self.reply_packer.key_since_ids.pop(user_id, None)  # Another worker owns its replies now
+            self.unprimed.pop(username, None)
+            self.last_tweet_ids.pop(username, None)
+            self.last_like_ids.pop(username, None)
+        self.changed.set()
+
+    async def read_commands(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            command = await loop.run_in_executor(None, self.commands.get)
+            if command[0] == 'stop':
+                self.changed.set()
+                return
+            self.apply_command(command)
+
+    def interval(self, username, job_class):
+        return poll_interval if job_class == 'replies' else self.poll_schedule.interval(username)
+
+    # First fetch of a moved account only sets the watermark
+    def should_deliver(self, username, job_class, had_since_id):
+        pending = self.unprimed.get(username)
+        if had_since_id or not pending or job_class not in pending:
+            return True
+        pending.discard(job_class)
+        return False
+
+    def deliver(self, username, message, kind, item_id):
+        self.deliveries.put((username, message, kind, item_id))
+
+    async def run(self):
+        reader = asyncio.create_task(self.read_commands())
+        logging.info(f"Shard worker {self.worker_id} started")
+        while not reader.done():
+            usernames = list(self.user_ids)
+            jobs = [(username, job_class) for username in usernames for job_class in ('tweets', 'likes')]
+            if usernames:
+                jobs.append((None, 'replies'))
+            self.scheduler.sync(jobs, self.interval)
+            now = time.time()
+            for username, job_class in self.scheduler.pop_ready(now):
+                if job_class == 'tweets':
+                    await self.worker_pool.submit(self.fetch_tweets, username, key=(username, job_class))
+                elif job_class == 'likes':
+                    await self.worker_pool.submit(self.fetch_likes, username, key=(username, job_class))
+                elif job_class == 'replies':
+                    await self.worker_pool.submit(self.fetch_replies, key=(username, job_class))
+                    self.scheduler.log_lag(now)
+                    self.worker_pool.log_stats()
+                    logging.info(f"Shard {self.worker_id}: {len(usernames)} accounts, {format_transfer_stats(take_transfer_stats())}")
+                self.scheduler.schedule(username, job_class, now + self.interval(username, job_class))
+            wakeup = self.scheduler.next_wakeup()
+            try:
+                await asyncio.wait_for(self.changed.wait(), min(max(wakeup, 0.1), 60) if wakeup is not None else 60)
+            except asyncio.TimeoutError:
+                pass
+            self.changed.clear()
+        await self.worker_pool.stop()
+        await close_session()
+
+    async def fetch_tweets(self, username):
+        user_id = self.user_ids.get(username)
+        if not user_id:
+            return  # Moved to another shard while queued
+        headers = {
+            "Authorization": f"Bearer {bearer_token}"
+        }
+        since_id = self.last_tweet_ids[username]
+        params = {"since_id": since_id, "max_results": 10}
+        tweets_response = await twitter_get(f"https://api.twitter.com/2/users/{user_id}/tweets", headers=headers, params=params)
+        if tweets_response.status_code != 200:
+            logging.error(f"Failed to fetch tweets for {username}: {tweets_response.status_code} {tweets_response.text}")
+            return
+        tweets = tweets_response.json().get('data', [])
+        if since_id:
+            self.poll_schedule.record(username, len(tweets))
+        deliver = self.should_deliver(username, 'tweets', since_id)
+        if not tweets:
+            return
+        if deliver:
+            for tweet in tweets:
+                tweet_link = f"https://twitter.com/{username}/status/{tweet['id']}"
+                timestamp = time.strftime("%I:%M %p", time.localtime(time.time()))
+                self.deliver(username, f"Tweet | {username} | [Post Link]({tweet_link})\n\n"
+                                       f"{shorten_text(tweet['text'])}\n\n"
+                                       f"X (formerly Twitter)\n"
+                                       f"@{username} on X\n"
+                                       f"Read more: [View on X]({tweet_link})\n"
+                                       f"{timestamp}", kind="Tweet", item_id=tweet['id'])
+        self.last_tweet_ids[username] = tweets[0]['id']
+
+    # Replies for the whole shard with packed from: searches, routed back by author
+    async def fetch_replies(self):
+        self.reply_packer.set_keys(self.user_ids.values())
+        usernames_by_id = {user_id: username for username, user_id in self.user_ids.items()}
+        primed = {user_id for user_id, since_id in self.reply_packer.key_since_ids.items() if since_id}
+        replies_by_author, decoded = await self.reply_packer.poll(profile_params("reply"))
+        for user_id, replies in replies_by_author.items():
+            username = usernames_by_id.get(user_id)
+            if username is None:
+                continue
+            if user_id in primed:
+                self.poll_schedule.record(username, len(replies))
+            if not self.should_deliver(username, 'replies', user_id in primed):
+                continue
+            for reply in replies:
+                tweet_link = f"https://twitter.com/{username}/status/{reply['id']}"
+                timestamp = time.strftime("%I:%M %p", time.localtime(time.time()))
+                if reply.get('in_reply_to_user_id'):
+                    post_owner = decoded.post_owner(reply) or await resolve_username(reply['in_reply_to_user_id']) or 'unknown_user'
+                    self.deliver(username, f"Reply | {username} | [Post Link]({tweet_link})\n\n"
+                                           f"{reply['text']}\n\n"
+                                           f"Reply to @{post_owner}\n"
+                                           f"Read more: [View on X]({tweet_link})\n"
+                                           f"{timestamp}", kind="Reply", item_id=reply['id'])
+                else:
+                    self.deliver(username, f"Reply | @{username} | [Post Link]({tweet_link})\n\n"
+                                           f"{reply['text']}\n"
+                                           f"Read more: [View on X]({tweet_link})\n"
+                                           f"{timestamp}", kind="Reply", item_id=reply['id'])
+        # Moved accounts with no recent replies have nothing left to prime
+        for pending in self.unprimed.values():
+            pending.discard('replies')
+
+    async def fetch_likes(self, username):
+        user_id = self.user_ids.get(username)
+        if not user_id:
+            return  # Moved to another shard while queued
+        headers = {
+            "Authorization": f"Bearer {oauth_token}"
+        }
+        since_id = self.last_like_ids[username]
+        params = {"since_id": since_id, "max_results": 10}
+        likes_response = await twitter_get(f"https://api.twitter.com/2/users/{user_id}/liked_tweets", headers=headers, params=params)
+        if likes_response.status_code != 200:
+            return
+        likes = likes_response.json().get('data', [])
+        deliver = self.should_deliver(username, 'likes', since_id)
+        if not likes:
+            return
+        if deliver:
+            for like in likes:
+                tweet_link = f"https://twitter.com/{username}/status/{like['id']}"
+                timestamp = time.strftime("%I:%M %p", time.localtime(time.time()))
+                self.deliver(username, f"Like | @{username} | [Post Link]({tweet_link})\n\n"
+                                       f"{like['text']}\n"
+                                       f"Read more: [View on X]({tweet_link})\n"
+                                       f"{timestamp}", kind="Like", item_id=like['id'])
+        self.last_like_ids[username] = likes[0]['id']
+
+# Process entry point
+def run_shard_worker(worker_id, commands, deliveries):
+    logging.basicConfig(level=logging.INFO, format=f"%(asctime)s shard-{worker_id} %(levelname)s %(message)s")
+    asyncio.run(ShardWorker(worker_id, commands, deliveries).run())
@@ -0,0 +1,96 @@
+import logging
+import asyncio
+from telethon import TelegramClient, events
+import os
+from dotenv import load_dotenv
+from user_manager import save_chat_id
+from user_resolver import resolve_user_ids
+from subscriptions import SubscriptionRegistry
+from task_commands import register_task_commands
+from delivery import get_delivery
+from shard_supervisor import ShardSupervisor
+
+# Load environment variables
+load_dotenv()
+
+# Telegram bot setup
+telegram_api_id = os.getenv('TELEGRAM_API_ID')
+telegram_api_hash = os.getenv('TELEGRAM_API_HASH')
+telegram_bot_token = os.getenv('TELEGRAM_ACCESS_TOKEN')
+
+shard_workers = int(os.getenv('SHARD_WORKERS', 4))
+admin_user_ids = [int(user_id) for user_id in os.getenv('SHARD_ADMIN_IDS', '').split(',') if user_id.strip()]
+
+# Delivery process for the sharded deployment: the only process with a Telethon session.
+# Ingest workers poll their share of the accounts and send rendered notifications here.
+# Everything runs from main() because spawned workers re-import this module.
+def main():
+    logging.basicConfig(level=logging.INFO)
+    supervisor = ShardSupervisor()
+    for _ in range(shard_workers):
+        supervisor.add_worker()
+
+    telegram_client = TelegramClient('bot', telegram_api_id, telegram_api_hash).start(bot_token=telegram_bot_token)
+    subscriptions = SubscriptionRegistry()
+    register_task_commands(telegram_client, subscriptions)  # /tasks, /pause, /resume, /cancel
+
+    # Handler for /start command
+    @telegram_client.on(events.NewMessage(pattern='/start'))
+    async def handler(event):
+        save_chat_id(event.chat_id)
+        await event.respond("Welcome! Enter Twitter usernames to monitor (comma-separated).")
+
+    # Handler for /shards command: accounts per ingest worker
+    @telegram_client.on(events.NewMessage(pattern='^/shards$'))
+    async def shards_handler(event):
+        sizes = supervisor.shard_sizes()
+        lines = [f"Worker {worker_id}: {count} accounts" for worker_id, count in sorted(sizes.items())]
+        await event.respond("\n".join(lines))
+
+    # Handler for /addshard command: grow the pool, moving only the accounts that hash to the new worker
+    @telegram_client.on(events.NewMessage(pattern='^/addshard$'))
+    async def add_shard_handler(event):
+        if event.sender_id not in admin_user_ids:
+            await event.respond("You don't have permission to add workers.")
+            return
+        worker_id = supervisor.add_worker()
+        await event.respond(f"Started worker {worker_id}.")
+
+    @telegram_client.on(events.NewMessage)
+    async def username_handler(event):
+        if event.message.message.startswith('/'):
+            return  # Commands have their own handlers
+        usernames = event.message.message.strip().replace('@', '').split(',')
+        for username in usernames:
+            subscriptions.subscribe(event.chat_id, username)
+        await event.respond(f"Monitoring accounts: {', '.join(usernames)}...")
+
+    # Keep the shards in line with the registry and replace crashed workers
+    async def sync_shards():
+        while True:
+            user_ids = await resolve_user_ids(subscriptions.accounts())
+            supervisor.assign(user_ids)
+            supervisor.restart_dead_workers()
+            await subscriptions.wait_for_change(30)
+
+    # Fan notifications from every worker out to the subscribed chats
+    async def deliver_notifications():
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await loop.run_in_executor(None, supervisor.deliveries.get)
+            if item is None:
+                return
+            username, message, kind, item_id = item
+            await subscriptions.notify(telegram_client, username, message, kind=kind, item_id=item_id)
+
+    telegram_client.loop.create_task(sync_shards())
+    telegram_client.loop.create_task(deliver_notifications())
+    telegram_client.loop.create_task(get_delivery(telegram_client).resume())  # Notifications a previous run left unsent
+    try:
+        telegram_client.run_until_disconnected()
+    finally:
+        supervisor.stop()
+        get_delivery(telegram_client).close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+import asyncio
+import json
+import logging
+import time
+from twitter_client import twitter_stream
+from field_profiles import profile_params
+from tweet_decoder import decode_response
+from stream_rules import StreamRules
+from stream_reader import StreamReader
+
+stream_url = "https://api.twitter.com/2/tweets/search/stream"
+
+# Reconnect delays from Twitter's streaming guidance: linear for network errors,
+# exponential for HTTP errors, and a slower exponential for 429s
+def reconnect_delay(kind, failures):
+    if kind == 'network':
+        return min(0.25 * failures, 16)
+    if kind == 'rate_limit':
+        return min(60 * 2 ** (failures - 1), 960)
+    return min(5 * 2 ** (failures - 1), 320)
+
+# Tweets streamed for an account after one of its tweets was shed
+class HeldTweets:
+    def __init__(self, shed_at):
+        self.shed_at = shed_at  # When the latest tweet was shed; only a poll started after it recovers it
+        self.tweets = []
+        self.releasing = False
+
+# Filtered stream as the primary source of tweets from monitored accounts. Pollers ask
+# covers(account) before fetching a timeline: an account is covered only while the stream is
+# connected, its rule is in place, and it has been polled once since both, so nothing posted
+# before the stream picked it up is lost. A disconnect or stall uncovers every account at once
+# and polling resumes until the stream is back. Matches queue in a StreamReader and are
+# delivered by a separate task, so a slow Telegram never holds up the connection.
+# When a tweet is shed, the account's later tweets are held back rather than delivered, so
+# they cannot move its watermark past the shed one before a poll has picked it up; the poll
+# releases them.
+class StreamIngest:
+    def __init__(self, bearer_token, on_tweet, fallback_polling=True):
+        self.bearer_token = bearer_token
+        self.on_tweet = on_tweet  # async on_tweet(username, tweet)
+        self.fallback_polling = fallback_polling  # Without a poller there is nothing to wait for after shedding
+        self.rules = StreamRules(bearer_token)
+        self.reader = StreamReader(on_shed=self.shed)
+        self.connected_at = None  # Set while the stream is up
+        self.polled = {}  # account -> start of its last successful timeline poll
+        self.held = {}  # account -> HeldTweets, for accounts waiting on a recovery poll
+        self.failures = 0
+        self.reconnects = 0
+        self.delivered = 0
+        self.wanted_accounts = None  # Accounts the rules should cover, set by want_rules()
+        self.rules_changed = asyncio.Event()
+
+    @property
+    def headers(self):
+        return {"Authorization": f"Bearer {self.bearer_token}"}
+
+    def covers(self, account):
+        rule_added = self.rules.added.get(account)
+        if self.connected_at is None or rule_added is None:
+            return False
+        return self.polled.get(account, 0) >= max(self.connected_at, rule_added)
+
+    # Whether the account lost a tweet to shedding and is waiting for a poll to recover it
+    def recovering(self, account):
+        return account in self.held
+
+    # Record the start time of a successful poll of the account's timeline, once the poll's
+    # tweets have been delivered. A poll that started after the last shed tweet recovered it.
+    def mark_polled(self, account, started):
+        self.polled[account] = started
+        held = self.held.get(account)
+        if held is not None and started >= held.shed_at and not held.releasing:
+            held.releasing = True
+            asyncio.ensure_future(self.release(account, held))
+
+    # Deliver the tweets held back behind a shed one, oldest first; tweets arriving meanwhile
+    # are held too, so nothing overtakes them
+    async def release(self, account, held):
+        shed_at = held.shed_at
+        while held.tweets:
+            await self.deliver_one(account, held.tweets.pop(0))
+        held.releasing = False
+        if held.shed_at == shed_at:
+            del self.held[account]
+
+    # Bring the stream rules in line with the accounts; only changed rules are sent.
+    # Returns False if a rules request failed.
+    async def sync_rules(self, accounts):
+        return await self.rules.sync(accounts)
+
+    # Ask for the rules to cover `accounts` without waiting; run() syncs them in the background
+    def want_rules(self, accounts):
+        accounts = set(accounts)
+        if accounts != self.wanted_accounts:
+            self.wanted_accounts = accounts
+            self.rules_changed.set()
+
+    # Sync the rules whenever the wanted accounts change, retrying failures with backoff,
+    # so a rules endpoint that is down or off limits never holds up polling
+    async def sync_rules_forever(self):
+        failures = 0
+        while True:
+            if failures:
+                delay = reconnect_delay('http', failures)
+                try:
+                    await asyncio.wait_for(self.rules_changed.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await self.rules_changed.wait()
+            self.rules_changed.clear()
+            try:
+                synced = await self.sync_rules(self.wanted_accounts)
+            except Exception as e:
+                logging.error(f"Failed to sync stream rules: {e!r}")
+                synced = False
+            failures = 0 if synced else failures + 1
+
+    # Keep the stream connected, and its rules in line, for the life of the bot
+    async def run(self):
+        delivery = asyncio.create_task(self.deliver())
+        rule_sync = asyncio.create_task(self.sync_rules_forever())
+        try:
+            await self.connect_forever()
+        finally:
+            delivery.cancel()
+            rule_sync.cancel()
+
+    async def connect_forever(self):
+        while True:
+            try:
+                kind = await self.consume()
+            except (asyncio.TimeoutError, OSError) as e:
+                kind = 'network'
+                logging.error(f"Filtered stream stalled or dropped: {e!r}")
+            except Exception as e:
+                kind = 'network'
+                logging.error(f"Filtered stream failed: {e!r}")
+            finally:
+                if self.connected_at is not None:
+                    logging.warning("Filtered stream disconnected; polling every monitored account until it is back")
+                self.connected_at = None
+            self.failures += 1
+            self.reconnects += 1
+            delay = reconnect_delay(kind, self.failures)
+            logging.info(f"Reconnecting to the filtered stream in {delay:.1f} seconds")
+            await asyncio.sleep(delay)
+
+    # One connection; returns the kind of failure that ended it
+    async def consume(self):
+        async with twitter_stream(stream_url, headers=self.headers, params=profile_params("stream")) as response:
+            if response.status_code != 200:
+                logging.error(f"Failed to connect to the filtered stream: {response.status_code} {await response.text()}")
+                return 'rate_limit' if response.status_code == 429 else 'http'
+            self.connected_at = time.time()
+            self.failures = 0
+            logging.info("Filtered stream connected")
+            await self.reader.pump(response.chunks, self.decode)
+            return 'network'
+
+    # Stream line -> (account, tweet) for each monitored account it was matched for
+    def decode(self, line):
+        try:
+            payload = json.loads(line)
+        except ValueError:
+            logging.error(f"Unreadable filtered stream message: {line[:200]!r}")
+            return []
+        if 'data' not in payload:
+            logging.error(f"Filtered stream message without data: {payload}")
+            return []
+        decoded = decode_response({**payload, "data": [payload['data']]})
+        accounts = self.rules.route(payload)  # Matches for other rules on the app are not ours
+        items = []
+        for tweet in decoded.data:
+            username = (decoded.author(tweet) or '').lower()
+            if username in self.held and username in accounts:
+                self.held[username].tweets.append(tweet)  # Behind a shed tweet, waits for the recovery poll
+            elif username in accounts:
+                items.append((username, tweet))
+        return items
+
+    # A tweet the queue had no room for: uncover its account so the next poll picks it up,
+    # and hold its later tweets back until then
+    def shed(self, item):
+        username = item[0]
+        self.polled.pop(username, None)
+        if not self.fallback_polling:
+            return
+        if username in self.held:
+            self.held[username].shed_at = time.time()
+        else:
+            self.held[username] = HeldTweets(time.time())
+
+    # Hand queued tweets to on_tweet, as fast as delivery allows and independent of the connection
+    async def deliver(self):
+        while True:
+            username, tweet = await self.reader.get()
+            await self.deliver_one(username, tweet)
+
+    async def deliver_one(self, username, tweet):
+        try:
+            await self.on_tweet(username, tweet)
+            self.delivered += 1
+        except Exception as e:
+            logging.error(f"Failed to deliver streamed tweet {tweet.get('id')} for {username}: {e!r}")
+
+    def describe(self, accounts):
+        if self.connected_at is None:
+            return f"Filtered stream down ({self.reconnects} reconnects), polling all {len(accounts)} accounts"
+        covered = sum(1 for account in accounts if self.covers(account))
+        return (f"Filtered stream up, covering {covered} of {len(accounts)} accounts, {self.delivered} tweets delivered, "
+                f"{len(self.held)} accounts recovering shed tweets; {self.reader.describe()}")
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import os
+import time
+
+# Twitter sends a keep-alive newline every 20 seconds, so this long without a byte means a dead connection
+stall_timeout = float(os.getenv('STREAM_STALL_TIMEOUT', 30))
+stream_queue_size = int(os.getenv('STREAM_QUEUE_SIZE', 5000))
+# Past this many queued items delivery is falling behind; counted and logged, the reader never waits
+stream_high_water = int(os.getenv('STREAM_HIGH_WATER', stream_queue_size * 8 // 10))
+
+# Splits a raw byte stream into CRLF-delimited lines, carrying partial lines across chunks.
+# Keep-alive heartbeats come out as empty lines.
+class LineFramer:
+    def __init__(self):
+        self.buffer = b''
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        *lines, self.buffer = self.buffer.split(b'\r\n')
+        return [line.strip() for line in lines]
+
+# Reads a long-lived stream into a bounded queue that delivery drains at its own pace.
+# Reading never waits on delivery: a full socket buffer is how Twitter spots a slow consumer
+# and cuts the connection. Time spent above the high-water mark is counted as backpressure;
+# once the queue is full each further item is shed and handed to `on_shed`, so the caller
+# can recover it some other way.
+class StreamReader:
+    def __init__(self, on_shed=None, queue_size=stream_queue_size, high_water=stream_high_water):
+        self.on_shed = on_shed
+        self.high_water = min(high_water, queue_size)
+        self.queue = asyncio.Queue(queue_size)
+        self.over_since = None  # When the queue last rose past high_water, None while below it
+        self.messages = 0
+        self.heartbeats = 0
+        self.backpressure_events = 0
+        self.backpressure_seconds = 0.0
+        self.shed = 0
+        self.last_data = None
+
+    # Pump one connection's chunks through `decode(line)` (which returns items to queue) until
+    # the stream ends; raises asyncio.TimeoutError if nothing arrives for stall_timeout seconds
+    async def pump(self, chunks, decode):
+        framer = LineFramer()
+        iterator = chunks.__aiter__()
+        while True:
+            try:
+                chunk = await asyncio.wait_for(iterator.__anext__(), stall_timeout)
+            except StopAsyncIteration:
+                return
+            self.last_data = time.time()
+            for line in framer.feed(chunk):
+                if not line:
+                    self.heartbeats += 1
+                    continue
+                self.messages += 1
+                for item in decode(line):
+                    self.offer(item)
+
+    def offer(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.shed += 1
+            if self.on_shed is not None:
+                self.on_shed(item)
+            return
+        if self.over_since is None and self.queue.qsize() >= self.high_water:
+            self.over_since = time.monotonic()
+            self.backpressure_events += 1
+            logging.warning(f"Stream queue passed {self.high_water} items, delivery is falling behind")
+
+    async def get(self):
+        item = await self.queue.get()
+        if self.over_since is not None and self.queue.qsize() < self.high_water:
+            self.backpressure_seconds += time.monotonic() - self.over_since
+            self.over_since = None
+        return item
+
+    def describe(self):
+        backpressure_seconds = self.backpressure_seconds
+        if self.over_since is not None:
+            backpressure_seconds += time.monotonic() - self.over_since
+        return (f"{self.messages} messages, {self.heartbeats} heartbeats, {self.queue.qsize()} queued, "
+                f"{self.backpressure_events} times over high water ({backpressure_seconds:.1f}s), {self.shed} shed")
+
+    def log_stats(self):
+        logging.info(f"Stream reader: {self.describe()}")
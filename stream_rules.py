@@ -0,0 +1,170 @@
+import hashlib
+import logging
+import os
+import re
+import time
+from dotenv import load_dotenv
+from twitter_client import twitter_get, twitter_post
+
+# Load environment variables
+load_dotenv()
+
+rules_url = "https://api.twitter.com/2/tweets/search/stream/rules"
+
+# Filtered stream limits for the API access level (512 characters and 5 rules on Essential,
+# 1024 characters and 1000 rules on Academic)
+rule_max_length = int(os.getenv('STREAM_RULE_MAX_LENGTH', 512))
+rule_max_count = int(os.getenv('STREAM_RULE_MAX_COUNT', 5))
+rule_tag_prefix = "dessbot:"
+account_pattern = re.compile(r'from:(\w+)')
+handle_pattern = re.compile(r'^[A-Za-z0-9_]{1,15}$')
+
+def rule_value(accounts):
+    return " OR ".join(f"from:{account}" for account in sorted(accounts))
+
+# Stable tag for a set of accounts, so a rule is recognised again after a restart
+def rule_tag(accounts):
+    return rule_tag_prefix + hashlib.md5(rule_value(accounts).encode()).hexdigest()[:12]
+
+def rule_accounts(value):
+    return frozenset(account.lower() for account in account_pattern.findall(value))
+
+def fits(accounts, max_length):
+    return len(rule_value(accounts)) <= max_length
+
+# Work out the smallest change that takes the rules in `current` ({rule_id: accounts}) to
+# covering `desired`. Rules that still match exactly are left alone; a rule that lost accounts
+# is rewritten without them; new accounts go into rules being rewritten anyway, then into one
+# untouched rule with room to spare, and only then into a new rule while the count allows.
+# Returns (rule IDs to delete, account sets to add, accounts that did not fit anywhere).
+def plan_rules(current, desired, max_length=rule_max_length, max_count=rule_max_count):
+    desired = set(desired)
+    kept = {}  # rule ID -> accounts for rules left as they are
+    rewritten = []  # account sets to re-add in place of changed rules
+    deletes = []
+    for rule_id, accounts in current.items():
+        remaining = accounts & desired
+        if remaining == accounts:
+            kept[rule_id] = set(accounts)
+            continue
+        deletes.append(rule_id)
+        if remaining:
+            rewritten.append(set(remaining))
+    placed = set().union(*kept.values(), *rewritten)
+    unplaced = []
+    for account in sorted(desired - placed):
+        target = next((accounts for accounts in rewritten if fits(accounts | {account}, max_length)), None)
+        if target is None:
+            rule_id = next((rule_id for rule_id, accounts in kept.items() if fits(accounts | {account}, max_length)), None)
+            if rule_id is not None:
+                target = kept.pop(rule_id)
+                deletes.append(rule_id)
+                rewritten.append(target)
+        if target is None and len(kept) + len(rewritten) < max_count:
+            target = set()
+            rewritten.append(target)
+        if target is None:
+            unplaced.append(account)
+            continue
+        target.add(account)
+    return deletes, [frozenset(accounts) for accounts in rewritten], unplaced
+
+# The bot's stream rules on Twitter's side, kept in line with the followed accounts by
+# sending only the rules that changed. Rule tags map matches back to the accounts they cover.
+class StreamRules:
+    def __init__(self, bearer_token, max_length=rule_max_length, max_count=rule_max_count):
+        self.bearer_token = bearer_token
+        self.max_length = max_length
+        self.max_count = max_count
+        self.rules = {}  # rule ID -> accounts
+        self.tags = {}  # tag -> accounts
+        self.added = {}  # account -> since when a rule has covered it without a gap
+        self.unplaced = []
+        self.loaded = False
+
+    # Rules belong to the app that owns the token, so these requests never rotate to another pool member
+    @property
+    def headers(self):
+        return {"Authorization": f"Bearer {self.bearer_token}"}
+
+    def accounts(self):
+        return set(self.added)
+
+    # Adopt the rules a previous run left behind
+    async def load(self):
+        response = await twitter_get(rules_url, headers=self.headers, rotate=False)
+        if response.status_code != 200:
+            logging.error(f"Failed to fetch stream rules: {response.status_code} {response.text}")
+            return
+        self.loaded = True
+        now = time.time()
+        for rule in response.json().get('data', []):
+            if rule.get('tag', '').startswith(rule_tag_prefix):
+                self.remember(rule['id'], rule['tag'], rule_accounts(rule['value']), now)
+
+    def remember(self, rule_id, tag, accounts, now):
+        self.rules[rule_id] = accounts
+        self.tags[tag] = accounts
+        for account in accounts:
+            self.added.setdefault(account, now)
+
+    def forget(self, rule_ids):
+        for rule_id in rule_ids:
+            accounts = self.rules.pop(rule_id)
+            self.tags.pop(rule_tag(accounts), None)
+        still_covered = set().union(*self.rules.values())
+        for account in list(self.added):
+            if account not in still_covered:
+                del self.added[account]
+
+    # Apply the delta between the current rules and `accounts`; returns False if a request failed.
+    # Accounts that are not valid handles are left out, since no rule could match them back.
+    async def sync(self, accounts):
+        accounts = {account.lower() for account in accounts if handle_pattern.match(account)}
+        if not self.loaded:
+            await self.load()
+            if not self.loaded:
+                return False
+        deletes, adds, unplaced = plan_rules(self.rules, accounts, self.max_length, self.max_count)
+        if unplaced and unplaced != self.unplaced:
+            logging.warning(f"No room in the stream rules for {len(unplaced)} accounts; they stay on polling")
+        self.unplaced = unplaced
+        if not deletes and not adds:
+            return True
+        # Add before deleting so rewritten accounts stay covered, unless that would break the rule cap
+        if len(self.rules) + len(adds) > self.max_count:
+            if not await self.delete(deletes):
+                return False
+            deletes = []
+        if adds and not await self.add(adds):
+            return False
+        if deletes and not await self.delete(deletes):
+            return False
+        logging.info(f"Stream rules: {len(self.rules)} rules covering {len(self.added)} accounts")
+        return True
+
+    async def add(self, account_sets):
+        rules = [{"value": rule_value(accounts), "tag": rule_tag(accounts)} for accounts in account_sets]
+        response = await twitter_post(rules_url, headers=self.headers, json_body={"add": rules}, rotate=False)
+        if response.status_code != 201:
+            logging.error(f"Failed to add stream rules: {response.status_code} {response.text}")
+            return False
+        now = time.time()
+        for rule in response.json().get('data', []):
+            self.remember(rule['id'], rule['tag'], rule_accounts(rule['value']), now)
+        return True
+
+    async def delete(self, rule_ids):
+        response = await twitter_post(rules_url, headers=self.headers, json_body={"delete": {"ids": rule_ids}}, rotate=False)
+        if response.status_code != 200:
+            logging.error(f"Failed to delete stream rules: {response.status_code} {response.text}")
+            return False
+        self.forget(rule_ids)
+        return True
+
+    # Accounts a stream message was matched for, from the tags of its matching rules
+    def route(self, payload):
+        accounts = set()
+        for rule in payload.get('matching_rules', []):
+            accounts |= self.tags.get(rule.get('tag'), frozenset())
+        return accounts
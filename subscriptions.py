@@ -0,0 +1,142 @@
+import asyncio
+import functools
+import logging
+import time
+from delivery import get_delivery
+
+# Normalise a handle the way users type it ("@Name ", "name") to one registry key
+def normalize_account(account):
+    return account.strip().lstrip('@').lower()
+
+# One chat following one account; paused handles keep their place but receive nothing
+class MonitorHandle:
+    def __init__(self, chat_id, account):
+        self.chat_id = chat_id
+        self.account = account
+        self.paused = False
+        self.created = time.time()
+        self.notified = 0
+
+    @property
+    def state(self):
+        return 'paused' if self.paused else 'active'
+
+# Which chats follow which Twitter accounts. The bots poll every account with at least
+# one active subscriber once and fan each notification out to its active subscribers.
+class SubscriptionRegistry:
+    def __init__(self):
+        self.subscribers = {}  # account -> {chat ID: MonitorHandle}
+        self.chat_accounts = {}  # chat ID -> set of accounts
+        self.active_counts = {}  # account -> number of active handles
+        self.changed = asyncio.Event()  # Set when the set of polled accounts may have changed
+
+    def handle(self, chat_id, account):
+        return self.subscribers.get(normalize_account(account), {}).get(chat_id)
+
+    def set_active(self, handle, active):
+        if handle.paused != active:
+            return False
+        handle.paused = not active
+        self.active_counts[handle.account] = self.active_counts.get(handle.account, 0) + (1 if active else -1)
+        self.changed.set()
+        return True
+
+    # Returns True if the chat was not already subscribed to the account
+    def subscribe(self, chat_id, account):
+        account = normalize_account(account)
+        if not account:
+            return False
+        handles = self.subscribers.setdefault(account, {})
+        if chat_id in handles:
+            return False
+        handles[chat_id] = MonitorHandle(chat_id, account)
+        self.chat_accounts.setdefault(chat_id, set()).add(account)
+        self.active_counts[account] = self.active_counts.get(account, 0) + 1
+        self.changed.set()
+        return True
+
+    # Cancel a subscription; the account stops being polled once nobody follows it
+    def unsubscribe(self, chat_id, account):
+        handle = self.handle(chat_id, account)
+        if handle is None:
+            return False
+        self.set_active(handle, False)
+        handles = self.subscribers[handle.account]
+        del handles[chat_id]
+        if not handles:
+            del self.subscribers[handle.account]
+            del self.active_counts[handle.account]
+        accounts = self.chat_accounts[chat_id]
+        accounts.discard(handle.account)
+        if not accounts:
+            del self.chat_accounts[chat_id]
+        self.changed.set()
+        return True
+
+    # Drop every subscription of a chat; returns the accounts it followed
+    def unsubscribe_chat(self, chat_id):
+        accounts = self.accounts_for(chat_id)
+        for account in accounts:
+            self.unsubscribe(chat_id, account)
+        return accounts
+
+    # Pause or resume one of a chat's accounts, or all of them; returns the accounts changed
+    def pause(self, chat_id, account=None):
+        return self.set_chat_active(chat_id, account, False)
+
+    def resume(self, chat_id, account=None):
+        return self.set_chat_active(chat_id, account, True)
+
+    def set_chat_active(self, chat_id, account, active):
+        accounts = [normalize_account(account)] if account else self.accounts_for(chat_id)
+        changed = []
+        for account in accounts:
+            handle = self.handle(chat_id, account)
+            if handle is not None and self.set_active(handle, active):
+                changed.append(account)
+        return changed
+
+    # Chats that should hear about the account right now
+    def chats(self, account):
+        return {chat_id for chat_id, handle in self.subscribers.get(normalize_account(account), {}).items() if not handle.paused}
+
+    def accounts_for(self, chat_id):
+        return sorted(self.chat_accounts.get(chat_id, ()))
+
+    def handles_for(self, chat_id):
+        return [self.handle(chat_id, account) for account in self.accounts_for(chat_id)]
+
+    def is_followed(self, account):
+        return self.active_counts.get(normalize_account(account), 0) > 0
+
+    # Accounts with at least one active subscriber, i.e. the accounts to poll
+    def accounts(self):
+        return [account for account, count in self.active_counts.items() if count > 0]
+
+    # Sleep up to `timeout` seconds, waking early when subscriptions change
+    async def wait_for_change(self, timeout):
+        try:
+            await asyncio.wait_for(self.changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.changed.clear()
+
+    def count_notified(self, chat_id, account):
+        handle = self.handle(chat_id, account)
+        if handle is not None:  # The chat may have unsubscribed while the message was queued
+            handle.notified += 1
+
+    # Queue one message for every active subscriber of the account and return without waiting
+    # for Telegram; each chat's queue is sent in order, in parallel with the others. A burst of
+    # one kind ("Tweet", "Reply", "Like") from one account may be merged into a single message,
+    # and an item a chat already received (same kind and post ID) is not sent again. Messages
+    # sent without a kind are never merged.
+    async def notify(self, client, account, message, kind=None, item_id=None, **kwargs):
+        delivery = get_delivery(client)
+        if kind is None:
+            logging.warning(f"Notification for {account} has no kind; it will not be merged with others")
+        key = f"{kind}:{item_id}" if kind and item_id else None
+        group = (normalize_account(account), kind) if kind else None
+        for chat_id in self.chats(account):
+            delivery.enqueue(chat_id, message, on_sent=functools.partial(self.count_notified, chat_id, account),
+                             group=group, key=key, **kwargs)
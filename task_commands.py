@@ -0,0 +1,53 @@
+import time
+from telethon import events
+from delivery import get_delivery
+
+def format_age(seconds):
+    minutes = int(seconds // 60)
+    if minutes < 60:
+        return f"{minutes}m"
+    return f"{minutes // 60}h {minutes % 60}m"
+
+# Register /tasks, /pause, /resume and /cancel on a bot; each takes an optional @account,
+# otherwise it applies to every account the chat follows. /batch [seconds] shows or sets how
+# long the chat's notifications wait to be merged with others from the same account.
+def register_task_commands(telegram_client, subscriptions):
+    @telegram_client.on(events.NewMessage(pattern=r'^/tasks$'))
+    async def tasks_handler(event):
+        handles = subscriptions.handles_for(event.chat_id)
+        if not handles:
+            await event.respond("No accounts are being monitored in this chat.")
+            return
+        now = time.time()
+        lines = [f"@{handle.account} | {handle.state} | {format_age(now - handle.created)} | {handle.notified} sent" for handle in handles]
+        polled = len(subscriptions.accounts())
+        await event.respond("Monitored accounts:\n" + "\n".join(lines) + f"\n\nPolling {polled} accounts for all chats.")
+
+    @telegram_client.on(events.NewMessage(pattern=r'^/pause(?:\s+@?(\w+))?$'))
+    async def pause_handler(event):
+        paused = subscriptions.pause(event.chat_id, event.pattern_match.group(1))
+        await event.respond(f"Paused: {', '.join(paused)}" if paused else "Nothing to pause.")
+
+    @telegram_client.on(events.NewMessage(pattern=r'^/resume(?:\s+@?(\w+))?$'))
+    async def resume_handler(event):
+        resumed = subscriptions.resume(event.chat_id, event.pattern_match.group(1))
+        await event.respond(f"Resumed: {', '.join(resumed)}" if resumed else "Nothing to resume.")
+
+    @telegram_client.on(events.NewMessage(pattern=r'^/cancel(?:\s+@?(\w+))?$'))
+    async def cancel_handler(event):
+        account = event.pattern_match.group(1)
+        if account:
+            cancelled = [account.lower()] if subscriptions.unsubscribe(event.chat_id, account) else []
+        else:
+            cancelled = subscriptions.unsubscribe_chat(event.chat_id)
+        await event.respond(f"Stopped monitoring: {', '.join(cancelled)}" if cancelled else "Nothing to cancel.")
+
+    @telegram_client.on(events.NewMessage(pattern=r'^/batch(?:\s+(\d+(?:\.\d+)?))?$'))
+    async def batch_handler(event):
+        delivery = get_delivery(telegram_client)
+        seconds = event.pattern_match.group(1)
+        if seconds is None:
+            await event.respond(f"Notifications are batched for {delivery.coalesce_window(event.chat_id):g} seconds.")
+            return
+        window = delivery.set_coalesce_window(event.chat_id, float(seconds))
+        await event.respond(f"Notifications are now batched for {window:g} seconds." if window else "Notifications are now sent one by one.")
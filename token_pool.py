@@ -0,0 +1,128 @@
+import logging
+import os
+import time
+from dotenv import load_dotenv
+from rate_limiter import endpoint_for, endpoint_limit, get_budget, token_key
+
+# Load environment variables
+load_dotenv()
+
+usage_report_interval = int(os.getenv('TOKEN_USAGE_REPORT_INTERVAL', 300))
+
+def tokens_from_env(list_name, single_name):
+    tokens = [token.strip() for token in os.getenv(list_name, '').split(',') if token.strip()]
+    single = os.getenv(single_name)
+    if single and single not in tokens:
+        tokens.insert(0, single)
+    return tokens
+
+# Interchangeable tokens for one kind of access. Fetchers keep sending their configured
+# token; the client swaps in whichever pool member has the most budget left for the endpoint.
+class TokenPool:
+    def __init__(self, name, tokens):
+        self.name = name
+        self.tokens = tokens
+        self.disabled = {}  # token -> reason it was taken out of rotation (401s)
+        self.forbidden = {}  # endpoint -> tokens that got a 403 there, usually an app not entitled to it
+        self.usage = {token: {"requests": 0, "errors": 0, "rate_limited": 0} for token in tokens}
+
+    def active(self):
+        return [token for token in self.tokens if token not in self.disabled]
+
+    # Active tokens allowed on the endpoint
+    def usable(self, endpoint):
+        forbidden = self.forbidden.get(endpoint, set())
+        return [token for token in self.active() if token not in forbidden]
+
+    # Best usable token for the URL, skipping `exclude`; None if there is nothing left to try
+    def choose(self, url, exclude=()):
+        endpoint = endpoint_for(url)
+        now = time.time()
+        candidates = [token for token in self.usable(endpoint) if token not in exclude]
+        if not candidates:
+            return None
+
+        def headroom(token):
+            budget = get_budget(token, endpoint)
+            budget.roll_window(now)
+            remaining = budget.remaining if budget.known() else float('inf')  # Unused tokens go first
+            return remaining, -self.usage[token]["requests"]
+
+        with_budget = [token for token in candidates if headroom(token)[0] > 0]
+        if with_budget:
+            return max(with_budget, key=headroom)
+        # Everything is spent: take the token whose window resets first
+        return min(candidates, key=lambda token: get_budget(token, endpoint).reset or now)
+
+    def record(self, token, url, status_code):
+        usage = self.usage[token]
+        usage["requests"] += 1
+        if status_code == 429:
+            usage["rate_limited"] += 1
+        elif status_code >= 400:
+            usage["errors"] += 1
+        if status_code == 403:
+            # Only this endpoint is off limits to the token; it stays in rotation for the rest
+            endpoint = endpoint_for(url)
+            forbidden = self.forbidden.setdefault(endpoint, set())
+            if token not in forbidden:
+                forbidden.add(token)
+                logging.warning(f"Token {token_key(token)} in the {self.name} pool is forbidden on {endpoint} "
+                                f"({len(self.usable(endpoint))} of {len(self.tokens)} tokens left for it)")
+        elif status_code == 401 and token not in self.disabled and len(self.active()) > 1:
+            # The last active token is never disabled, so the pool always has one to fall back on
+            self.disabled[token] = f"401 from {endpoint_for(url)}"
+            logging.error(f"Token {token_key(token)} in the {self.name} pool returned 401; taking it out of rotation "
+                          f"({len(self.active())} of {len(self.tokens)} left)")
+
+    def describe(self):
+        parts = []
+        for token in self.tokens:
+            usage = self.usage[token]
+            state = f"disabled ({self.disabled[token]})" if token in self.disabled else "active"
+            forbidden = sorted(endpoint for endpoint, tokens in self.forbidden.items() if token in tokens)
+            if forbidden:
+                state += f", forbidden on {', '.join(forbidden)}"
+            parts.append(f"{token_key(token)} {state}: {usage['requests']} requests, {usage['rate_limited']} rate limited, {usage['errors']} errors")
+        return f"{self.name} tokens: " + "; ".join(parts)
+
+# App-only bearer tokens, and user-context tokens for endpoints such as liked_tweets
+pools = [
+    TokenPool('bearer', tokens_from_env('TWITTER_BEARER_TOKENS', 'TWITTER_BEARER_TOKEN')),
+    TokenPool('oauth', tokens_from_env('TWITTER_OAUTH_TOKENS', 'TWITTER_OAUTH_TOKEN')),
+]
+last_report = time.time()
+
+def pool_for(token):
+    for pool in pools:
+        if token in pool.usage:
+            return pool
+    return None
+
+# Requests per window the pool behind `token` can make to an endpoint: the learned limit of
+# every member usable there, `default` for members that have not seen a response yet
+def pool_limit(token, endpoint, default=None):
+    pool = pool_for(token)
+    tokens = pool.usable(endpoint) if pool is not None else [token]
+    return sum(endpoint_limit(member, endpoint, default) or 0 for member in tokens) or default
+
+# Token to use in place of `token` for this URL; tokens outside any pool are used as given
+def pick_token(token, url, exclude=()):
+    pool = pool_for(token)
+    if pool is None:
+        return None if token in exclude else token
+    return pool.choose(url, exclude)
+
+def record_token_result(token, url, status_code):
+    global last_report
+    pool = pool_for(token)
+    if pool is not None:
+        pool.record(token, url, status_code)
+    if time.time() - last_report >= usage_report_interval:
+        last_report = time.time()
+        log_token_usage()
+
+def log_token_usage():
+    for pool in pools:
+        if pool.tokens:
+            logging.info(pool.describe())
@@ -0,0 +1,40 @@
+from user_index import remember_user
+
+# Twitter API v2 payload with its `includes` section indexed by ID
+class DecodedResponse:
+    def __init__(self, payload):
+        self.data = payload.get('data', [])
+        self.meta = payload.get('meta', {})
+        includes = payload.get('includes', {})
+        self.users = {user['id']: user for user in includes.get('users', [])}
+        self.tweets = {tweet['id']: tweet for tweet in includes.get('tweets', [])}
+
+    # Fold another page or query into this one
+    def merge(self, other):
+        self.data.extend(other.data)
+        self.users.update(other.users)
+        self.tweets.update(other.tweets)
+        self.meta = other.meta
+
+    def username(self, user_id):
+        user = self.users.get(user_id)
+        return user['username'] if user else None
+
+    def author(self, tweet):
+        return self.username(tweet.get('author_id'))
+
+    # Username of the account whose post this tweet replies to (None if not expanded)
+    def post_owner(self, tweet):
+        if tweet.get('in_reply_to_user_id'):
+            return self.username(tweet['in_reply_to_user_id'])
+        for reference in tweet.get('referenced_tweets', []):
+            if reference['type'] == 'replied_to' and reference['id'] in self.tweets:
+                return self.author(self.tweets[reference['id']])
+        return None
+
+def decode_response(payload):
+    decoded = DecodedResponse(payload)
+    # Expanded users double as free username/ID lookups
+    for user in decoded.users.values():
+        remember_user(user['id'], user['username'])
+    return decoded
@@ -1,10 +1,11 @@
 import logging
 import asyncio
-import requests
 from telethon import TelegramClient, events
 import os
 from dotenv import load_dotenv
 from user_manager import save_chat_id, get_user_chat_ids
+from broadcaster import broadcast
+from twitter_client import twitter_get
 
 # Setup logging
 logging.basicConfig(level=logging.DEBUG)
@@ -34,8 +35,7 @@ async def handler(event):
 
 # Send messages to all users
 async def send_telegram_message(message):
-    for chat_id in get_user_chat_ids():
-        await telegram_client.send_message(chat_id, message)
+    await broadcast(telegram_client, get_user_chat_ids(), message)
 
 async def fetch_and_send_tweet(tweet_id):
     logging.debug(f"Fetching tweet with ID: {tweet_id}")
@@ -43,7 +43,7 @@ async def fetch_and_send_tweet(tweet_id):
         "Authorization": f"Bearer {bearer_token}"
     }
     url = f"https://api.twitter.com/2/tweets/{tweet_id}"
-    response = requests.get(url, headers=headers)
+    response = await twitter_get(url, headers=headers)
     if response.status_code == 200:
         tweet = response.json().get('data', {})
         if tweet:
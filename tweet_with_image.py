@@ -1,9 +1,9 @@
 import logging
 import asyncio
-import requests
 from telethon import TelegramClient
 import os
 from dotenv import load_dotenv
+from twitter_client import twitter_get
 
 # Setup logging
 logging.basicConfig(level=logging.DEBUG)
@@ -36,7 +36,7 @@ async def fetch_and_send_tweet_with_image(tweet_id):
         "Authorization": f"Bearer {bearer_token}"
     }
     url = f"https://api.twitter.com/2/tweets/{tweet_id}?expansions=attachments.media_keys&media.fields=url"
-    response = requests.get(url, headers=headers)
+    response = await twitter_get(url, headers=headers)
     if response.status_code == 200:
         tweet = response.json().get('data', {})
         includes = response.json().get('includes', {}).get('media', [])
@@ -0,0 +1,278 @@
+import asyncio
+import contextlib
+import gzip
+import json
+import logging
+import os
+import time
+import weakref
+import zlib
+import aiohttp
+from dotenv import load_dotenv
+from rate_limiter import acquire, update, token_from_headers, save_rate_limits, endpoint_for
+from token_pool import pick_token, record_token_result
+
+# Load environment variables
+load_dotenv()
+
+# Connection pool settings for Twitter API traffic
+max_connections = int(os.getenv('TWITTER_MAX_CONNECTIONS', 100))
+max_connections_per_host = int(os.getenv('TWITTER_MAX_CONNECTIONS_PER_HOST', 20))
+keepalive_timeout = float(os.getenv('TWITTER_KEEPALIVE_TIMEOUT', 60))
+request_timeout = float(os.getenv('TWITTER_REQUEST_TIMEOUT', 30))
+
+# Transport: 'http1' pools aiohttp keep-alive connections, 'http2' multiplexes every
+# fetcher as streams over a few httpx connections (needs the h2 package)
+transport = os.getenv('TWITTER_TRANSPORT', 'http1').lower()
+http2_connections = int(os.getenv('TWITTER_HTTP2_CONNECTIONS', 2))
+
+# Per-stream timeouts for HTTP/2, so one stalled stream fails without holding up the connection
+stream_connect_timeout = float(os.getenv('TWITTER_STREAM_CONNECT_TIMEOUT', 10))
+stream_read_timeout = float(os.getenv('TWITTER_STREAM_READ_TIMEOUT', request_timeout))
+stream_write_timeout = float(os.getenv('TWITTER_STREAM_WRITE_TIMEOUT', 10))
+stream_pool_timeout = float(os.getenv('TWITTER_STREAM_POOL_TIMEOUT', request_timeout))
+
+# One transport per running event loop (aiohttp and httpx clients are bound to their loop)
+_sessions = weakref.WeakKeyDictionary()
+
+# Bytes on the wire, bytes after decompression, latency and JSON decode time, per endpoint
+transfer_stats = {}
+
+def record_transfer(endpoint, requests=0, wire_bytes=0, body_bytes=0, decode_seconds=0.0, latency=None):
+    stats = transfer_stats.setdefault(endpoint, {"requests": 0, "wire_bytes": 0, "body_bytes": 0, "decode_seconds": 0.0, "latencies": []})
+    stats["requests"] += requests
+    stats["wire_bytes"] += wire_bytes
+    stats["body_bytes"] += body_bytes
+    stats["decode_seconds"] += decode_seconds
+    if latency is not None:
+        stats["latencies"].append(latency)
+
+# Return the stats gathered since the last call and start over
+def take_transfer_stats():
+    global transfer_stats
+    stats = transfer_stats
+    transfer_stats = {}
+    return stats
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+def format_transfer_stats(stats):
+    requests = sum(item["requests"] for item in stats.values())
+    wire_bytes = sum(item["wire_bytes"] for item in stats.values())
+    body_bytes = sum(item["body_bytes"] for item in stats.values())
+    decode_ms = sum(item["decode_seconds"] for item in stats.values()) * 1000
+    latencies = [latency for item in stats.values() for latency in item["latencies"]]
+    p95_ms = percentile(latencies, 0.95) * 1000
+    return f"{requests} requests, {wire_bytes} bytes on the wire ({body_bytes} decompressed), {decode_ms:.1f} ms decoding, p95 latency {p95_ms:.0f} ms"
+
+# Response wrapper exposing the parts of requests.Response the bots rely on
+class ApiResponse:
+    def __init__(self, status_code, headers, content, endpoint=None):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.endpoint = endpoint
+        self._json = None
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        if self._json is None:
+            started = time.perf_counter()
+            self._json = json.loads(self.content)
+            record_transfer(self.endpoint, decode_seconds=time.perf_counter() - started)
+        return self._json
+
+# Decompress the body ourselves so the compressed size can be measured
+def decode_body(raw, content_encoding):
+    if content_encoding == 'gzip':
+        return gzip.decompress(raw)
+    if content_encoding == 'deflate':
+        return zlib.decompress(raw)
+    return raw
+
+def make_response(url, status_code, headers, wire_bytes, content, latency):
+    endpoint = endpoint_for(url)
+    record_transfer(endpoint, requests=1, wire_bytes=wire_bytes, body_bytes=len(content), latency=latency)
+    return ApiResponse(status_code, headers, content, endpoint)
+
+# An open long-lived response (the filtered stream). `chunks` yields raw bytes as they arrive;
+# streams ask for identity encoding so no decompressor sits between the socket and the reader.
+class StreamResponse:
+    def __init__(self, status_code, headers, chunks):
+        self.status_code = status_code
+        self.headers = headers
+        self.chunks = chunks
+
+    # Rest of the body as text, for error responses
+    async def text(self):
+        body = b''.join([chunk async for chunk in self.chunks])
+        return body.decode('utf-8', errors='replace')
+
+# Drop unset query parameters, aiohttp refuses None values
+def clean_params(params):
+    if not params:
+        return None
+    return {key: value for key, value in params.items() if value is not None}
+
+# HTTP/1.1 keep-alive pool over aiohttp
+class Http1Transport:
+    name = 'http1'
+
+    def __init__(self):
+        connector = aiohttp.TCPConnector(
+            limit=max_connections,
+            limit_per_host=max_connections_per_host,
+            keepalive_timeout=keepalive_timeout,
+            ttl_dns_cache=300
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=request_timeout),
+            headers={"Accept-Encoding": "gzip, deflate"},
+            auto_decompress=False
+        )
+        logging.debug(f"Opened HTTP/1.1 Twitter API session (limit={max_connections}, per_host={max_connections_per_host})")
+
+    @property
+    def closed(self):
+        return self.session.closed
+
+    async def request(self, method, url, headers=None, params=None, json_body=None, timeout=None):
+        options = {"timeout": aiohttp.ClientTimeout(total=timeout)} if timeout else {}
+        started = time.perf_counter()
+        async with self.session.request(method, url, headers=headers, params=clean_params(params), json=json_body, **options) as response:
+            raw = await response.read()
+            latency = time.perf_counter() - started
+            content = decode_body(raw, response.headers.get('Content-Encoding', '').lower())
+            return make_response(url, response.status, response.headers, len(raw), content, latency)
+
+    # No overall timeout: a stream stays open for hours, the reader decides when it has stalled
+    @contextlib.asynccontextmanager
+    async def stream(self, url, headers=None, params=None):
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=stream_connect_timeout)
+        headers = {**(headers or {}), "Accept-Encoding": "identity"}
+        async with self.session.get(url, headers=headers, params=clean_params(params), timeout=timeout) as response:
+            yield StreamResponse(response.status, response.headers, response.content.iter_any())
+
+    async def close(self):
+        await self.session.close()
+
+# HTTP/2 over httpx: concurrent requests share a few connections as multiplexed streams
+class Http2Transport:
+    name = 'http2'
+
+    def __init__(self):
+        import httpx  # Only needed when TWITTER_TRANSPORT=http2
+        self.client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=http2_connections,
+                max_keepalive_connections=http2_connections,
+                keepalive_expiry=keepalive_timeout
+            ),
+            timeout=httpx.Timeout(
+                connect=stream_connect_timeout,
+                read=stream_read_timeout,
+                write=stream_write_timeout,
+                pool=stream_pool_timeout
+            ),
+            headers={"Accept-Encoding": "gzip, deflate"}
+        )
+        logging.debug(f"Opened HTTP/2 Twitter API client (connections={http2_connections})")
+
+    @property
+    def closed(self):
+        return self.client.is_closed
+
+    async def request(self, method, url, headers=None, params=None, json_body=None, timeout=None):
+        options = {"timeout": timeout} if timeout else {}
+        started = time.perf_counter()
+        response = await self.client.request(method, url, headers=headers, params=clean_params(params), json=json_body, **options)
+        latency = time.perf_counter() - started
+        # httpx has already decompressed the body; num_bytes_downloaded is the size on the wire
+        return make_response(url, response.status_code, response.headers, response.num_bytes_downloaded, response.content, latency)
+
+    @contextlib.asynccontextmanager
+    async def stream(self, url, headers=None, params=None):
+        import httpx
+        timeout = httpx.Timeout(stream_connect_timeout, read=None)
+        headers = {**(headers or {}), "Accept-Encoding": "identity"}
+        async with self.client.stream('GET', url, headers=headers, params=clean_params(params), timeout=timeout) as response:
+            yield StreamResponse(response.status_code, response.headers, response.aiter_raw())
+
+    async def close(self):
+        await self.client.aclose()
+
+def open_transport(name):
+    if name == 'http2':
+        try:
+            return Http2Transport()
+        except ImportError:
+            logging.error("HTTP/2 transport needs httpx and h2 installed. Falling back to HTTP/1.1.")
+    return Http1Transport()
+
+# Get (or lazily create) the shared transport for the current loop
+def get_session():
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        session = open_transport(transport)
+        _sessions[loop] = session
+    return session
+
+# Send one request with the best token from the caller's pool. A token that answers 401 is
+# dropped from rotation, a 403 keeps it off that endpoint and a 429 marks its window spent,
+# and each retries on the next pool member;
+# callers only see those statuses once the pool has nothing left to try. With rotate=False
+# the configured token is always used, for state tied to one app such as stream rules.
+async def send_request(method, url, headers, params=None, json_body=None, timeout=None, rotate=True):
+    configured = token_from_headers(headers)
+    tried = set()
+    token = (pick_token(configured, url) if rotate else None) or configured
+    while True:
+        if token != configured:
+            headers = {**headers, "Authorization": f"Bearer {token}"}
+        await acquire(token, url)
+        response = await get_session().request(method, url, headers=headers, params=params, json_body=json_body, timeout=timeout)
+        update(token, url, response.status_code, response.headers)
+        record_token_result(token, url, response.status_code)
+        if response.status_code not in (401, 403, 429) or not rotate:
+            return response
+        tried.add(token)
+        token = pick_token(configured, url, exclude=tried)
+        if token is None:
+            return response
+
+# Non-blocking GET against the Twitter API over the shared transport, paced by the rate limiter.
+# `timeout` overrides the request (or, on HTTP/2, per-stream) timeout for this call only.
+async def twitter_get(url, headers=None, params=None, timeout=None, rotate=True):
+    return await send_request('GET', url, headers, params=params, timeout=timeout, rotate=rotate)
+
+# Non-blocking POST against the Twitter API over the shared transport, paced by the rate limiter
+async def twitter_post(url, headers=None, json_body=None, timeout=None, rotate=True):
+    return await send_request('POST', url, headers, json_body=json_body, timeout=timeout, rotate=rotate)
+
+# Hold a streaming GET open over the shared transport. The token is not rotated: stream
+# rules belong to the app that owns the token.
+@contextlib.asynccontextmanager
+async def twitter_stream(url, headers=None, params=None):
+    token = token_from_headers(headers)
+    await acquire(token, url)
+    async with get_session().stream(url, headers=headers, params=params) as response:
+        update(token, url, response.status_code, response.headers)
+        yield response
+
+# Close the session owned by the current loop
+async def close_session():
+    loop = asyncio.get_running_loop()
+    session = _sessions.pop(loop, None)
+    if session is not None and not session.closed:
+        await session.close()
+    save_rate_limits()
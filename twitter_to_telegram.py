@@ -1,9 +1,9 @@
 import logging
 import asyncio
-import requests
 from telethon import TelegramClient
 import os
 from dotenv import load_dotenv
+from twitter_client import twitter_get
 import schedule
 import time
 
@@ -39,9 +39,9 @@ async def fetch_and_send_tweets():
     }
     query = "from:Christo16784414 OR to:Christo16784414"
     url = f"https://api.twitter.com/2/tweets/search/recent?query={query}&max_results=10"
-    response = requests.get(url, headers=headers)
+    response = await twitter_get(url, headers=headers)
     if response.status_code == 200:
-        logging.debug(f"Response Data: {response.json()}")
+        logging.debug(f"Response: {response.status_code}, {len(response.content)} bytes")
         tweets = response.json().get('data', [])
         if not tweets:
             logging.debug("No tweets found.")
@@ -1,9 +1,9 @@
 import logging
 import asyncio
-import requests
 from telethon import TelegramClient
 import os
 from dotenv import load_dotenv
+from twitter_client import twitter_get
 
 # Setup logging
 logging.basicConfig(level=logging.DEBUG)
@@ -36,7 +36,7 @@ async def fetch_user_by_id(user_id):
         "Authorization": f"Bearer {bearer_token}"
     }
     url = f"https://api.twitter.com/2/users/{user_id}"
-    response = requests.get(url, headers=headers)
+    response = await twitter_get(url, headers=headers)
     if response.status_code == 200:
         user = response.json().get('data', {})
         if user:
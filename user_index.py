@@ -0,0 +1,113 @@
+import json
+import logging
+import os
+import tempfile
+import time
+
+# Disk-backed username <-> user ID index, stored as an append-only JSON lines log
+index_file = os.getenv('USER_INDEX_FILE', 'user_index.jsonl')
+positive_ttl = int(os.getenv('USER_INDEX_TTL', 7 * 24 * 3600))  # Resolved accounts
+negative_ttl = int(os.getenv('USER_INDEX_NEGATIVE_TTL', 3600))  # Not found / suspended accounts
+
+# username (lowercase) -> entry, user ID -> entry
+usernames = {}
+user_ids = {}
+log_lines = 0
+
+def is_fresh(entry):
+    ttl = negative_ttl if entry.get('missing') else positive_ttl
+    return time.time() - entry['ts'] < ttl
+
+def apply_entry(entry):
+    if entry.get('username'):
+        usernames[entry['username'].lower()] = entry
+    if entry.get('id'):
+        user_ids[entry['id']] = entry
+
+def append_entry(entry):
+    global log_lines
+    apply_entry(entry)
+    with open(index_file, 'a') as file:
+        file.write(json.dumps(entry) + '\n')
+    log_lines += 1
+    if needs_compaction():
+        compact_index()
+
+# Look up a username; returns (found, user_id) where user_id is None for cached misses
+def lookup_user_id(username):
+    entry = usernames.get(username.lower())
+    if entry is None or not is_fresh(entry):
+        return False, None
+    if entry.get('missing'):
+        return True, None
+    # A later rename may have handed this handle to another account
+    if user_ids.get(entry['id']) is not entry:
+        return False, None
+    return True, entry['id']
+
+# Look up a user ID; returns (found, username) where username is None for cached misses
+def lookup_username(user_id):
+    entry = user_ids.get(str(user_id))
+    if entry is None or not is_fresh(entry):
+        return False, None
+    if entry.get('missing'):
+        return True, None
+    return True, entry['username']
+
+def remember_user(user_id, username):
+    user_id = str(user_id)
+    entry = user_ids.get(user_id)
+    if entry and entry.get('username') == username and not entry.get('missing') and is_fresh(entry):
+        return
+    append_entry({'id': user_id, 'username': username, 'ts': time.time()})
+
+def remember_missing_username(username, reason):
+    append_entry({'username': username.lower(), 'missing': reason, 'ts': time.time()})
+
+def remember_missing_id(user_id, reason):
+    append_entry({'id': str(user_id), 'missing': reason, 'ts': time.time()})
+
+# The log is rewritten once it holds more than twice the entries still in use
+def needs_compaction():
+    return log_lines > 2 * max(len(usernames) + len(user_ids), 100)
+
+# Rewrite the log with only the latest entry per key
+def compact_index():
+    global log_lines
+    entries = {}
+    for entry in list(usernames.values()) + list(user_ids.values()):
+        # Skip expired entries and handles that were since taken over by a rename
+        superseded = entry.get('id') and user_ids.get(entry['id']) is not entry
+        if is_fresh(entry) and not superseded:
+            entries[id(entry)] = entry
+    # Shard processes share the index, so each writes through its own temp file
+    fd, temp_file = tempfile.mkstemp(prefix=os.path.basename(index_file) + '.', dir=os.path.dirname(os.path.abspath(index_file)))
+    with os.fdopen(fd, 'w') as file:
+        for entry in entries.values():
+            file.write(json.dumps(entry) + '\n')
+    os.replace(temp_file, index_file)
+    log_lines = len(entries)
+
+def load_user_index():
+    global log_lines
+    usernames.clear()
+    user_ids.clear()
+    log_lines = 0
+    if not os.path.exists(index_file):
+        return
+    with open(index_file, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                apply_entry(json.loads(line))
+            except ValueError:
+                logging.error(f"Skipping corrupt line in {index_file}")
+            log_lines += 1
+    logging.info(f"Loaded {len(usernames)} usernames and {len(user_ids)} user IDs from {index_file}")
+    if needs_compaction():
+        compact_index()
+
+# Load the index at the start
+load_user_index()
@@ -0,0 +1,227 @@
+import asyncio
+import logging
+import os
+import re
+import time
+import weakref
+from collections import OrderedDict
+from dotenv import load_dotenv
+from twitter_client import twitter_get
+from field_profiles import profile_params
+from user_index import lookup_user_id, lookup_username, remember_user, remember_missing_username, remember_missing_id
+
+# Load environment variables
+load_dotenv()
+
+# Twitter API setup
+bearer_token = os.getenv('TWITTER_BEARER_TOKEN')
+
+# The multi-user lookup endpoints accept at most 100 users per request
+max_batch_size = 100
+batch_window = float(os.getenv('USER_LOOKUP_BATCH_WINDOW', 0.05))  # Seconds to wait for more keys
+max_lookup_attempts = int(os.getenv('USER_LOOKUP_ATTEMPTS', 4))  # Tries on server or network errors
+
+username_pattern = re.compile(r'^[A-Za-z0-9_]{1,15}$')
+
+# Bounded LRU cache with hit/miss counters
+class LRUCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0.0
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses, "hit_rate": hit_rate}
+
+# In-memory ID -> username cache in front of the disk index
+username_cache = LRUCache(int(os.getenv('USERNAME_CACHE_SIZE', 5000)))
+
+# Collects keys for a short window and resolves them with a single batched request.
+# Callers asking for a key that is already pending or in flight share its future.
+class BatchLoader:
+    def __init__(self, batch_fn, max_batch_size=max_batch_size, batch_window=batch_window):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self.pending = {}
+        self.in_flight = {}
+        self.flush_handle = None
+
+    async def load(self, key):
+        future = self.in_flight.get(key) or self.pending.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self.pending[key] = future
+            if len(self.pending) >= self.max_batch_size:
+                self.dispatch()
+            elif self.flush_handle is None:
+                self.flush_handle = asyncio.get_running_loop().call_later(self.batch_window, self.dispatch)
+        return await asyncio.shield(future)
+
+    def dispatch(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if not self.pending:
+            return
+        batch = self.pending
+        self.pending = {}
+        self.in_flight.update(batch)
+        asyncio.ensure_future(self.run_batch(batch))
+
+    async def run_batch(self, batch):
+        try:
+            results = await self.batch_fn(list(batch))
+            for key, future in batch.items():
+                if not future.done():
+                    future.set_result(results.get(key))
+        except Exception as error:
+            logging.error(f"Batched lookup failed for {len(batch)} keys: {error}")
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(error)
+        finally:
+            for key, future in batch.items():
+                if self.in_flight.get(key) is future:
+                    del self.in_flight[key]
+
+# GET a lookup endpoint, sleeping through rate limits and backing off on server and network
+# errors for at most max_lookup_attempts tries. Other errors will not go away on a retry, so
+# they return {} at once rather than holding up every caller waiting on the batch.
+async def fetch_with_retry(url, params):
+    headers = {
+        "Authorization": f"Bearer {bearer_token}"
+    }
+    backoff_time = 10
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            response = await twitter_get(url, headers=headers, params=params)
+        except Exception as e:  # Network errors, from whichever transport is in use
+            logging.error(f"Failed user lookup on {url}: {e!r}")
+            response = None
+        if response is not None and response.status_code == 429:
+            reset_time = int(response.headers.get("x-rate-limit-reset", time.time() + 60))
+            sleep_time = max(reset_time - time.time(), 1)
+            logging.info(f"Rate limit hit on {url}. Sleeping for {sleep_time} seconds.")
+            await asyncio.sleep(sleep_time)
+            attempt -= 1  # Waiting out a rate limit is not a failed attempt
+            continue
+        if response is not None and response.status_code == 200:
+            try:
+                return response.json()
+            except ValueError:
+                logging.error("Failed to decode JSON response.")
+                return {}
+        if response is not None:
+            logging.error(f"Failed user lookup on {url}: {response.status_code} {response.text}")
+            if response.status_code < 500:
+                return {}
+        if attempt >= max_lookup_attempts:
+            logging.error(f"Giving up on user lookup on {url} after {attempt} attempts")
+            return {}
+        await asyncio.sleep(backoff_time)
+        backoff_time = min(backoff_time * 2, 320)  # Exponential backoff
+
+# Map an API lookup error to the reason we cache it under (None if it should be retried)
+def missing_reason(error):
+    if error.get('type', '').endswith('resource-not-found'):
+        return 'not_found'
+    if 'suspended' in error.get('detail', '').lower():
+        return 'suspended'
+    if error.get('type', '').endswith('resource-not-authorized'):
+        return 'forbidden'
+    return None
+
+# Resolve up to 100 usernames with one /2/users/by request
+async def fetch_user_ids(usernames):
+    payload = await fetch_with_retry("https://api.twitter.com/2/users/by", profile_params("user_lookup", usernames=",".join(usernames)))
+    user_ids = {}
+    for user in payload.get('data', []):
+        user_ids[user['username'].lower()] = user['id']
+        remember_user(user['id'], user['username'])
+    for error in payload.get('errors', []):
+        logging.error(f"Username '{error.get('value')}' not resolved: {error.get('title')}")
+        reason = missing_reason(error)
+        if reason and error.get('value'):
+            remember_missing_username(error['value'], reason)
+    return {username: user_ids.get(username) for username in usernames}
+
+# Loaders are bound to the loop that created their futures
+_loaders = weakref.WeakKeyDictionary()
+
+def get_loader(batch_fn):
+    loop = asyncio.get_running_loop()
+    loaders = _loaders.setdefault(loop, {})
+    if batch_fn not in loaders:
+        loaders[batch_fn] = BatchLoader(batch_fn)
+    return loaders[batch_fn]
+
+# Resolve a single username to its user ID (None if it does not exist)
+async def resolve_user_id(username):
+    username = username.strip().lstrip('@').lower()
+    if not username_pattern.match(username):
+        logging.error(f"Username '{username}' is not a valid Twitter handle.")
+        return None
+    found, user_id = lookup_user_id(username)
+    if found:
+        return user_id
+    return await get_loader(fetch_user_ids).load(username)
+
+# Resolve many usernames at once, sharing as few lookup requests as possible
+async def resolve_user_ids(usernames):
+    results = await asyncio.gather(*(resolve_user_id(username) for username in usernames))
+    return dict(zip(usernames, results))
+
+# Resolve up to 100 user IDs with one /2/users?ids= request
+async def fetch_usernames(user_ids):
+    headers = {
+        "Authorization": f"Bearer {bearer_token}"
+    }
+    response = await twitter_get("https://api.twitter.com/2/users", headers=headers, params=profile_params("user_lookup", ids=",".join(user_ids)))
+    if response.status_code != 200:
+        logging.error(f"Error fetching usernames: {response.status_code} {response.text}")
+        return {}
+    payload = response.json()
+    usernames = {}
+    for user in payload.get('data', []):
+        usernames[user['id']] = user['username']
+        remember_user(user['id'], user['username'])
+    for error in payload.get('errors', []):
+        reason = missing_reason(error)
+        if reason and error.get('value'):
+            remember_missing_id(error['value'], reason)
+    logging.debug(f"Resolved {len(usernames)}/{len(user_ids)} user IDs, username cache: {username_cache.stats()}")
+    return usernames
+
+# Resolve a user ID to its username (None if it does not exist).
+# Checks the LRU, then the disk index, then joins the next batched lookup.
+async def resolve_username(user_id):
+    user_id = str(user_id)
+    username = username_cache.get(user_id)
+    if username:
+        return username
+    found, username = lookup_username(user_id)
+    if not found:
+        username = await get_loader(fetch_usernames).load(user_id)
+    if username:
+        username_cache.put(user_id, username)
+    return username
@@ -0,0 +1,103 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from collections.abc import MutableMapping
+
+# Newest item seen per (account, endpoint), so the first poll after a restart can use since_id
+# instead of refetching the last page. Stored as {endpoint: {account: since_id}}.
+watermark_file = os.getenv('WATERMARK_FILE', 'watermarks.json')
+flush_interval = float(os.getenv('WATERMARK_FLUSH_INTERVAL', 5))  # Seconds changes may wait to be written together
+
+# search/recent only reaches back 7 days and answers 400 to an older since_id; keep a margin
+search_window = float(os.getenv('SEARCH_SINCE_ID_MAX_AGE', 7 * 24 * 3600 - 3600))
+twitter_epoch_ms = 1288834974657  # Tweet IDs are snowflakes: their top bits are milliseconds since this
+
+watermarks = {}  # endpoint -> WatermarkView
+flush_handle = None
+
+# Dict of account -> since_id for one endpoint; assignments are written out in batches.
+# Unset (None) watermarks stay in memory only.
+class WatermarkView(MutableMapping):
+    def __init__(self, endpoint, ids=None):
+        self.endpoint = endpoint
+        self.ids = dict(ids or {})
+
+    def __getitem__(self, account):
+        return self.ids[account]
+
+    def __setitem__(self, account, since_id):
+        changed = self.ids.get(account) != since_id
+        self.ids[account] = since_id
+        if changed and since_id is not None:
+            schedule_flush()
+
+    def __delitem__(self, account):
+        del self.ids[account]
+        schedule_flush()
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def saved(self):
+        return {account: since_id for account, since_id in self.ids.items() if since_id is not None}
+
+def tweet_age(tweet_id):
+    return time.time() - ((int(tweet_id) >> 22) + twitter_epoch_ms) / 1000
+
+# since_id to send to search/recent: None once the tweet is too old for the search window,
+# which only drops matches from before the window that the search cannot return anyway
+def search_since_id(since_id):
+    if since_id and tweet_age(since_id) > search_window:
+        return None
+    return since_id
+
+# Watermarks for one endpoint ('tweets', 'replies', 'likes'), loaded from disk on first use
+def watermark_view(endpoint):
+    if endpoint not in watermarks:
+        watermarks[endpoint] = WatermarkView(endpoint)
+    return watermarks[endpoint]
+
+# Write on the next flush_interval tick, so a burst of updates costs one write
+def schedule_flush():
+    global flush_handle
+    if flush_handle is not None:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        save_watermarks()
+        return
+    flush_handle = loop.call_later(flush_interval, save_watermarks)
+
+def save_watermarks():
+    global flush_handle
+    if flush_handle is not None:
+        flush_handle.cancel()
+        flush_handle = None
+    # A fresh temp file per write, so two bots sharing the file never write through the same one
+    fd, temp_file = tempfile.mkstemp(prefix=os.path.basename(watermark_file) + '.', dir=os.path.dirname(os.path.abspath(watermark_file)))
+    with os.fdopen(fd, 'w') as file:
+        json.dump({endpoint: view.saved() for endpoint, view in watermarks.items()}, file)
+    os.replace(temp_file, watermark_file)
+
+def load_watermarks():
+    if not os.path.exists(watermark_file):
+        return
+    try:
+        with open(watermark_file, 'r') as file:
+            saved = json.load(file)
+    except ValueError:
+        logging.error(f"Ignoring corrupt watermarks in {watermark_file}")
+        return
+    for endpoint, ids in saved.items():
+        watermarks[endpoint] = WatermarkView(endpoint, ids)
+    logging.info(f"Loaded watermarks for {sum(len(ids) for ids in saved.values())} accounts from {watermark_file}")
+
+# Load persisted watermarks at the start
+load_watermarks()
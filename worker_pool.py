@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import os
+import time
+
+worker_concurrency = int(os.getenv('WORKER_CONCURRENCY', 8))
+worker_queue_size = int(os.getenv('WORKER_QUEUE_SIZE', 1000))
+
+# Run time and queue wait per job function, since the last take_stats()
+class JobStats:
+    def __init__(self):
+        self.runs = 0
+        self.failures = 0
+        self.run_seconds = 0.0
+        self.max_run_seconds = 0.0
+        self.wait_seconds = 0.0
+
+    def record(self, wait_seconds, run_seconds, failed):
+        self.runs += 1
+        self.failures += int(failed)
+        self.run_seconds += run_seconds
+        self.max_run_seconds = max(self.max_run_seconds, run_seconds)
+        self.wait_seconds += wait_seconds
+
+# Bounded asyncio.Queue drained by N worker coroutines on the running loop.
+# submit() waits while the queue is full, so producers slow down instead of piling up jobs.
+# Jobs submitted with a key (such as (account, job class)) never overlap: while one is queued
+# or running, later submissions with the same key are skipped.
+class WorkerPool:
+    def __init__(self, concurrency=worker_concurrency, max_queue_size=worker_queue_size):
+        self.concurrency = concurrency
+        self.max_queue_size = max_queue_size
+        self.queue = None
+        self.workers = []
+        self.stats = {}
+        self.in_flight = set()  # Keys of jobs queued or running
+        self.skipped = 0
+
+    # Start the workers on the current loop; safe to call more than once
+    def start(self):
+        if self.workers:
+            return
+        self.queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self.workers = [asyncio.create_task(self.worker()) for _ in range(self.concurrency)]
+        logging.info(f"Started {self.concurrency} workers (queue size {self.max_queue_size})")
+
+    # Queue a job; returns False if a job with the same key is still queued or running
+    async def submit(self, job, *args, key=None):
+        self.start()
+        if key is not None:
+            if key in self.in_flight:
+                self.skipped += 1
+                logging.debug(f"Skipping {job.__name__} for {key}, the previous run has not finished")
+                return False
+            self.in_flight.add(key)
+        if self.queue.full():
+            logging.debug(f"Worker queue full, waiting to submit {job.__name__}")
+        try:
+            await self.queue.put((job, args, time.perf_counter(), key))
+        except BaseException:
+            self.in_flight.discard(key)
+            raise
+        return True
+
+    async def worker(self):
+        while True:
+            job, args, submitted, key = await self.queue.get()
+            started = time.perf_counter()
+            failed = False
+            try:
+                await job(*args)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                failed = True
+                logging.exception(f"Job {job.__name__} failed")
+            finally:
+                finished = time.perf_counter()
+                self.stats.setdefault(job.__name__, JobStats()).record(started - submitted, finished - started, failed)
+                self.in_flight.discard(key)
+                self.queue.task_done()
+
+    # Per-job stats since the last call
+    def take_stats(self):
+        stats = self.stats
+        self.stats = {}
+        return stats
+
+    def log_stats(self):
+        stats = self.take_stats()
+        queued = self.queue.qsize() if self.queue else 0
+        skipped, self.skipped = self.skipped, 0
+        summary = ", ".join(
+            f"{name}: {item.runs} runs ({item.failures} failed), avg {item.run_seconds / item.runs:.2f}s, "
+            f"max {item.max_run_seconds:.2f}s, avg wait {item.wait_seconds / item.runs:.2f}s"
+            for name, item in sorted(stats.items())
+        )
+        logging.info(f"Workers: {queued} queued, {skipped} skipped while still running; {summary or 'no jobs run'}")
+
+    # Let queued jobs finish, then stop the workers
+    async def stop(self):
+        if not self.workers:
+            return
+        await self.queue.join()
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []